@@ -9,6 +9,7 @@ from dotenv import load_dotenv
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 # Handle both relative and absolute imports
 try:
@@ -44,7 +45,8 @@ app = FastAPI(
     description="AI-powered semantic search and analysis of oceanographic data with authentication",
     version="2.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
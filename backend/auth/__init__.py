@@ -7,6 +7,7 @@ from .auth_service import auth_service, AuthenticationError
 from .auth_models import *
 from .auth_middleware import (
     AuthenticationMiddleware,
+    load_auth_caches,
     get_current_user,
     require_authentication,
     require_verified_user,
@@ -40,6 +41,7 @@ __all__ = [
     
     # Middleware and Dependencies
     "AuthenticationMiddleware",
+    "load_auth_caches",
     "get_current_user",
     "require_authentication", 
     "require_verified_user",
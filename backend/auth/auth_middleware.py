@@ -3,26 +3,97 @@ Authentication Middleware for ARGO Agentic RAG
 JWT and API key authentication middleware
 """
 
+from __future__ import annotations
+
 import time
+import asyncio
+from dataclasses import dataclass
 from typing import Optional, Tuple, Dict, Any
 from datetime import datetime, timezone
 
 from fastapi import Request, HTTPException, status, Depends
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from starlette.middleware.base import BaseHTTPMiddleware
 
 from .auth_service import auth_service, AuthenticationError
-from .auth_models import UserProfile, AuthStatus
 
-# Security scheme for JWT tokens
-security = HTTPBearer(auto_error=False)
+# Shared placeholder when an account creation time is not available
+_UNKNOWN_CREATED_AT = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Permissions granted to each user tier
+_PERMISSIONS = {
+    "standard": ("basic_search", "basic_rag"),
+    "premium": ("basic_search", "basic_rag", "advanced_search", "export_data"),
+    "researcher": ("basic_search", "basic_rag", "advanced_search", "export_data", "bulk_access", "analytics"),
+    "admin": ("all_features",)
+}
+_DEFAULT_PERMISSIONS = ("basic_search",)
+
+# Rate limits per user tier
+_RATE_LIMITS = {
+    "standard": {"per_minute": 5, "per_hour": 20, "per_day": 100},
+    "premium": {"per_minute": 15, "per_hour": 100, "per_day": 1000},
+    "researcher": {"per_minute": 30, "per_hour": 500, "per_day": 5000},
+    "admin": {"per_minute": 100, "per_hour": 1000, "per_day": 10000}
+}
+_ANONYMOUS_RATE_LIMITS = {"per_minute": 10, "per_hour": 100, "per_day": 500}
+
+# Request counters are packed into one int: minute count in bits 0-15, hour
+# count in bits 16-39, day count in bits 40-63. The top bit of each lane is a
+# guard bit, so limits must stay below 2**15 (minute) and 2**23 (hour, day).
+_MINUTE_LANE = 0xFFFF
+_DAY_LANE = 0xFFFFFF << 40
+_LANE_GUARD_BITS = (1 << 15) | (1 << 39) | (1 << 63)
+_LANE_INCREMENT = 1 | (1 << 16) | (1 << 40)
+
+def _pack_limits(limits: Dict[str, int]) -> int:
+    """Pack per-minute/hour/day limits into counter lanes"""
+    return limits["per_minute"] | (limits["per_hour"] << 16) | (limits["per_day"] << 40)
+
+_PACKED_RATE_LIMITS = {tier: _pack_limits(limits) for tier, limits in _RATE_LIMITS.items()}
+_PACKED_ANONYMOUS_LIMITS = _pack_limits(_ANONYMOUS_RATE_LIMITS)
+
+# How long a built user profile is reused before the row is refetched
+USER_CACHE_TTL_SECONDS = 60
+USER_CACHE_MAX_ENTRIES = 10000
+
+@dataclass(slots=True)
+class _UserProfileLite:
+    """Unvalidated UserProfile for middleware state (data comes from DB/JWT)"""
+    id: str
+    email: str
+    user_tier: str
+    is_active: bool
+    is_verified: bool
+    created_at: datetime
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    full_name: Optional[str] = None
+    google_id: Optional[str] = None
+    avatar_url: Optional[str] = None
+    last_login: Optional[datetime] = None
+    daily_query_count: int = 0
+    total_queries: int = 0
+
+@dataclass(slots=True)
+class _AuthStatusLite:
+    """Unvalidated AuthStatus stored on request.state"""
+    authenticated: bool
+    method: str
+    user: Optional[_UserProfileLite] = None
+    permissions: tuple[str, ...] = ()
+
+# Shared result for requests without valid credentials
+_UNAUTHENTICATED = _AuthStatusLite(authenticated=False, method="none")
 
 class AuthenticationMiddleware(BaseHTTPMiddleware):
     """Middleware for authentication and rate limiting"""
     
     def __init__(self, app):
         super().__init__(app)
-        self.rate_limits = {}  # In-memory rate limiting (use Redis in production)
+        self.rate_limits = {}  # identifier -> (minute, hour, day, packed_counts)
+        self._user_cache = {}  # user_id -> (expires_at, _UserProfileLite)
+        self._prefix_refresh = None  # In-flight API key prefix reload
     
     async def dispatch(self, request: Request, call_next):
         """Process authentication for each request"""
@@ -71,78 +142,134 @@ class AuthenticationMiddleware(BaseHTTPMiddleware):
         
         return any(path.startswith(p) for p in public_paths)
     
-    async def _authenticate_request(self, request: Request) -> AuthStatus:
+    async def _authenticate_request(self, request: Request) -> _AuthStatusLite:
         """Authenticate request via JWT or API key"""
         
         # Try API key first (header: X-API-Key)
-        api_key = request.headers.get("X-API-Key")
-        if api_key:
-            try:
-                api_result = auth_service.verify_api_key(api_key)
-                if api_result:
-                    user_profile = UserProfile(
-                        id=api_result["user_id"],
-                        email=api_result["email"],
-                        user_tier=api_result["user_tier"],
-                        is_active=api_result["is_active"],
-                        is_verified=True,
-                        created_at=datetime.now(timezone.utc),
-                        daily_query_count=0,
-                        total_queries=0
-                    )
-                    
-                    return AuthStatus(
-                        authenticated=True,
-                        user=user_profile,
-                        method="api_key",
-                        permissions=api_result.get("permissions", ["basic_search"])
-                    )
-            except Exception:
-                pass
+        if (api_key := request.headers.get("X-API-Key")) and await self._is_known_api_key_prefix(api_key):
+            api_result = await asyncio.to_thread(self._verify_api_key, api_key)
+            
+            if api_result:
+                user_profile = _UserProfileLite(
+                    id=str(api_result["user_id"]),
+                    email=api_result["email"],
+                    user_tier=api_result["user_tier"],
+                    is_active=api_result["is_active"],
+                    is_verified=True,
+                    created_at=api_result.get("created_at") or _UNKNOWN_CREATED_AT,
+                    daily_query_count=0,
+                    total_queries=0
+                )
+                
+                return _AuthStatusLite(
+                    authenticated=True,
+                    user=user_profile,
+                    method="api_key",
+                    permissions=tuple(api_result.get("permissions") or _DEFAULT_PERMISSIONS)
+                )
         
         # Try JWT token (Authorization: Bearer <token>)
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
-            try:
-                payload = auth_service.verify_jwt_token(token)
-                if payload and payload.get("type") == "access":
-                    # Get user info from database
-                    user_info = self._get_user_by_id(payload["sub"])
-                    if user_info:
-                        user_profile = UserProfile(**user_info)
-                        return AuthStatus(
-                            authenticated=True,
-                            user=user_profile,
-                            method="jwt",
-                            permissions=self._get_user_permissions(user_profile.user_tier)
-                        )
-            except AuthenticationError:
-                pass
+        if not (auth_header := request.headers.get("Authorization")) or not auth_header.startswith("Bearer "):
+            return _UNAUTHENTICATED
+        
+        # Verify the signature before touching the cache or the database, so
+        # forged tokens can neither trigger user queries nor evict cache entries.
+        # Runs in a thread because the revocation check may query Redis
+        if not (payload := await asyncio.to_thread(self._verify_access_token, auth_header[len("Bearer "):])):
+            return _UNAUTHENTICATED
+        
+        if not (user_id := payload.get("sub")):
+            return _UNAUTHENTICATED
+        
+        # Get user profile (cached, falls back to database off the event loop)
+        if not (user_profile := self._get_cached_user_profile(user_id)):
+            user_profile = await asyncio.to_thread(self._fetch_user_profile, user_id)
         
-        # No valid authentication found
-        return AuthStatus(
-            authenticated=False,
-            user=None,
-            method="none",
-            permissions=[]
+        if not user_profile:
+            return _UNAUTHENTICATED
+        
+        return _AuthStatusLite(
+            authenticated=True,
+            user=user_profile,
+            method="jwt",
+            permissions=self._get_user_permissions(user_profile.user_tier)
         )
     
+    async def _is_known_api_key_prefix(self, api_key: str) -> bool:
+        """Prefix pre-check; every prefix reload runs in a worker thread, never on the event loop"""
+        if auth_service.api_key_prefixes_stale():
+            self._refresh_api_key_prefixes()  # Periodic refresh in the background
+        
+        if auth_service.is_known_api_key_prefix(api_key):
+            return True
+        
+        # The set is per process: a key created on another worker is missing until a reload
+        if self._prefix_refresh_running() or auth_service.api_key_prefix_miss_reload_allowed():
+            await self._refresh_api_key_prefixes()
+            return auth_service.is_known_api_key_prefix(api_key)
+        return False
+    
+    def _prefix_refresh_running(self) -> bool:
+        return self._prefix_refresh is not None and not self._prefix_refresh.done()
+    
+    def _refresh_api_key_prefixes(self) -> asyncio.Future:
+        """Start (or join) the one in-flight prefix reload"""
+        if not self._prefix_refresh_running():
+            self._prefix_refresh = asyncio.ensure_future(
+                asyncio.to_thread(auth_service.reload_api_key_prefixes)
+            )
+        return self._prefix_refresh
+    
+    def _verify_api_key(self, api_key: str) -> Optional[Dict[str, Any]]:
+        """Blocking API key lookup, run in a worker thread"""
+        try:
+            return auth_service.verify_api_key(api_key)
+        except AuthenticationError:
+            return None
+    
+    def _verify_access_token(self, token: str) -> Optional[Dict[str, Any]]:
+        """Verify JWT signature and return the payload of a valid access token"""
+        try:
+            payload = auth_service.verify_jwt_token(token)
+        except AuthenticationError:
+            return None
+        return payload if payload.get("type") == "access" else None
+    
+    def _get_cached_user_profile(self, user_id: str) -> Optional[_UserProfileLite]:
+        """Get user profile from cache if its TTL has not expired"""
+        cached = self._user_cache.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        return None
+    
+    def _fetch_user_profile(self, user_id: str) -> Optional[_UserProfileLite]:
+        """Fetch user row, build the profile and cache it"""
+        user_info = self._get_user_by_id(user_id)
+        if not user_info:
+            self._user_cache.pop(user_id, None)
+            return None
+        
+        if len(self._user_cache) >= USER_CACHE_MAX_ENTRIES:
+            self._user_cache.clear()
+        
+        user_profile = _UserProfileLite(**user_info)
+        self._user_cache[user_id] = (time.monotonic() + USER_CACHE_TTL_SECONDS, user_profile)
+        return user_profile
+    
     def _get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
         """Get user info from database by ID"""
         try:
-            conn = auth_service.get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, email, username, first_name, last_name, 
-                       user_tier, is_active, is_verified, google_id, avatar_url,
-                       created_at, last_login, daily_query_count, total_queries
-                FROM users WHERE id = %s AND is_active = true
-            """, (user_id,))
-            
-            row = cursor.fetchone()
-            conn.close()
+            with auth_service.get_db_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    SELECT id, email, username, first_name, last_name, 
+                           user_tier, is_active, is_verified, google_id, avatar_url,
+                           created_at, last_login, daily_query_count, total_queries
+                    FROM users WHERE id = %s AND is_active = true
+                """, (user_id,))
+                
+                row = cursor.fetchone()
             
             if row:
                 return {
@@ -161,77 +288,68 @@ class AuthenticationMiddleware(BaseHTTPMiddleware):
                     "daily_query_count": row[12] or 0,
                     "total_queries": row[13] or 0
                 }
+        except HTTPException:
+            raise  # Pool exhausted: surface the 503 rather than a spurious 401
         except Exception:
             pass
         
         return None
     
-    def _get_user_permissions(self, user_tier: str) -> List[str]:
+    def _get_user_permissions(self, user_tier: str) -> tuple[str, ...]:
         """Get permissions based on user tier"""
-        permissions_map = {
-            "standard": ["basic_search", "basic_rag"],
-            "premium": ["basic_search", "basic_rag", "advanced_search", "export_data"],
-            "researcher": ["basic_search", "basic_rag", "advanced_search", "export_data", "bulk_access", "analytics"],
-            "admin": ["all_features"]
-        }
-        return permissions_map.get(user_tier, ["basic_search"])
+        return _PERMISSIONS.get(user_tier, _DEFAULT_PERMISSIONS)
     
-    def _check_rate_limits(self, request: Request, auth: AuthStatus) -> bool:
+    def _check_rate_limits(self, request: Request, auth: _AuthStatusLite) -> bool:
         """Check rate limits based on user tier or IP"""
         
         # Get identifier for rate limiting
         if auth.authenticated and auth.user:
             identifier = f"user:{auth.user.id}"
-            limits = self._get_user_rate_limits(auth.user.user_tier)
+            packed_limits = _PACKED_RATE_LIMITS.get(auth.user.user_tier, _PACKED_RATE_LIMITS["standard"])
         else:
             # Use IP for unauthenticated requests
             client_ip = request.client.host
             identifier = f"ip:{client_ip}"
-            limits = {"per_minute": 10, "per_hour": 100, "per_day": 500}  # Default limits
+            packed_limits = _PACKED_ANONYMOUS_LIMITS
         
-        # Simple in-memory rate limiting (use Redis in production)
-        current_time = time.time()
+        # Fixed minute/hour/day windows (use Redis in production)
+        now = int(time.time())
+        minute, hour, day = now // 60, now // 3600, now // 86400
         
-        # Clean old entries
-        if identifier in self.rate_limits:
-            self.rate_limits[identifier] = [
-                timestamp for timestamp in self.rate_limits[identifier]
-                if current_time - timestamp < 86400  # Keep last 24 hours
-            ]
+        state = self.rate_limits.get(identifier)
+        if state is None or state[2] != day:
+            packed_counts = 0
+        elif state[1] != hour:
+            packed_counts = state[3] & _DAY_LANE
+        elif state[0] != minute:
+            packed_counts = state[3] & ~_MINUTE_LANE
         else:
-            self.rate_limits[identifier] = []
+            packed_counts = state[3]
         
-        # Add current request
-        self.rate_limits[identifier].append(current_time)
+        # One subtraction checks all three lanes: a lane's guard bit is
+        # cleared only when its count exceeds its limit
+        admitted_counts = packed_counts + _LANE_INCREMENT
+        if ((packed_limits | _LANE_GUARD_BITS) - admitted_counts) & _LANE_GUARD_BITS != _LANE_GUARD_BITS:
+            self.rate_limits[identifier] = (minute, hour, day, packed_counts)
+            return False
         
-        # Check limits
-        minute_count = len([t for t in self.rate_limits[identifier] if current_time - t < 60])
-        hour_count = len([t for t in self.rate_limits[identifier] if current_time - t < 3600])
-        day_count = len([t for t in self.rate_limits[identifier] if current_time - t < 86400])
-        
-        return (minute_count <= limits["per_minute"] and 
-                hour_count <= limits["per_hour"] and 
-                day_count <= limits["per_day"])
-    
-    def _get_user_rate_limits(self, user_tier: str) -> Dict[str, int]:
-        """Get rate limits based on user tier"""
-        limits_map = {
-            "standard": {"per_minute": 5, "per_hour": 20, "per_day": 100},
-            "premium": {"per_minute": 15, "per_hour": 100, "per_day": 1000},
-            "researcher": {"per_minute": 30, "per_hour": 500, "per_day": 5000},
-            "admin": {"per_minute": 100, "per_hour": 1000, "per_day": 10000}
-        }
-        return limits_map.get(user_tier, limits_map["standard"])
+        self.rate_limits[identifier] = (minute, hour, day, admitted_counts)
+        return True
+
+async def load_auth_caches():
+    """Startup hook: load the API key prefix set before serving requests.
+    Register with app.add_event_handler("startup", load_auth_caches)."""
+    await asyncio.to_thread(auth_service.reload_api_key_prefixes)
 
 # Dependency functions for FastAPI
-async def get_current_user(request: Request) -> Optional[UserProfile]:
+async def get_current_user(request: Request) -> Optional[_UserProfileLite]:
     """Get currently authenticated user"""
-    auth: AuthStatus = getattr(request.state, "auth", None)
+    auth: _AuthStatusLite = getattr(request.state, "auth", None)
     if auth and auth.authenticated:
         return auth.user
     return None
 
-async def require_authentication(request: Request) -> UserProfile:
+async def require_authentication(request: Request) -> _UserProfileLite:
     """Require authentication - raise 401 if not authenticated"""
     user = await get_current_user(request)
     if not user:
@@ -242,7 +360,7 @@ async def require_authentication(request: Request) -> UserProfile:
         )
     return user
 
-async def require_verified_user(request: Request) -> UserProfile:
+async def require_verified_user(request: Request) -> _UserProfileLite:
     """Require verified user account"""
     user = await require_authentication(request)
     if not user.is_verified:
@@ -252,13 +370,15 @@ async def require_verified_user(request: Request) -> UserProfile:
         )
     return user
 
-async def require_permission(permission: str):
+def require_permission(permission: str):
     """Create dependency that requires specific permission"""
-    async def _check_permission(request: Request) -> UserProfile:
+    accepted = frozenset({permission, "all_features"})
+    
+    async def _check_permission(request: Request) -> _UserProfileLite:
         user = await require_verified_user(request)
-        auth: AuthStatus = getattr(request.state, "auth", None)
+        auth: _AuthStatusLite = getattr(request.state, "auth", None)
         
-        if auth and (permission in auth.permissions or "all_features" in auth.permissions):
+        if auth and not accepted.isdisjoint(auth.permissions):
             return user
         
         raise HTTPException(
@@ -3,9 +3,9 @@ Authentication Models for ARGO Agentic RAG
 Pydantic models for authentication endpoints
 """
 
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Mapping
 from datetime import datetime
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
 from enum import Enum
 
 class UserTier(str, Enum):
@@ -72,8 +72,17 @@ class UserProfile(BaseModel):
     daily_query_count: int = 0
     total_queries: int = 0
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, defer_build=True)
+
+    @classmethod
+    def from_row(cls, row: Mapping[str, Any]) -> "UserProfile":
+        """Build from a trusted users row without re-validating each field"""
+        data = {name: row[name] for name in cls.model_fields if name in row}
+        data["id"] = str(data["id"])
+        data["user_tier"] = UserTier(data["user_tier"])
+        data["daily_query_count"] = data.get("daily_query_count") or 0
+        data["total_queries"] = data.get("total_queries") or 0
+        return cls.model_construct(**data)
 
 class TokenResponse(BaseModel):
     access_token: str
@@ -82,6 +91,8 @@ class TokenResponse(BaseModel):
     expires_in: int = 1800  # 30 minutes
     user: UserProfile
 
+    model_config = ConfigDict(defer_build=True)
+
 class APIKeyResponse(BaseModel):
     key_id: int
     key_name: str
@@ -89,6 +100,8 @@ class APIKeyResponse(BaseModel):
     key_prefix: str = Field(description="First 12 characters for identification")
     created_at: datetime
 
+    model_config = ConfigDict(defer_build=True)
+
 class APIKeyInfo(BaseModel):
     key_id: int
     key_name: str
@@ -99,12 +112,16 @@ class APIKeyInfo(BaseModel):
     last_used: Optional[datetime] = None
     usage_count: int = 0
 
+    model_config = ConfigDict(defer_build=True)
+
 class AuthStatus(BaseModel):
     authenticated: bool
     user: Optional[UserProfile] = None
     method: str = Field(description="jwt, api_key, or none")
     permissions: List[str] = []
 
+    model_config = ConfigDict(defer_build=True)
+
 class UserStats(BaseModel):
     daily_queries: int
     total_queries: int
@@ -112,6 +129,8 @@ class UserStats(BaseModel):
     account_age_days: int
     last_login: Optional[datetime] = None
 
+    model_config = ConfigDict(defer_build=True)
+
 # Error Response Models
 class AuthError(BaseModel):
     error: str
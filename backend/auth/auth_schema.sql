@@ -22,7 +22,7 @@ CREATE TABLE IF NOT EXISTS api_keys (
     key_id SERIAL PRIMARY KEY,
     user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
     key_name VARCHAR(255) NOT NULL,
-    api_key VARCHAR(255) UNIQUE NOT NULL,
+    api_key_hash BYTEA UNIQUE NOT NULL,  -- SHA-256 of the key; plaintext is never stored
     key_prefix VARCHAR(10) NOT NULL,
     is_active BOOLEAN DEFAULT true,
     permissions TEXT[],
@@ -49,6 +49,11 @@ CREATE TABLE IF NOT EXISTS otp_tokens (
     attempts INTEGER DEFAULT 0
 );
 
+-- Partial indexes for the hot auth look-ups (see migrations/003_auth_partial_indexes.sql)
+CREATE UNIQUE INDEX IF NOT EXISTS users_email_active_idx ON users (email) WHERE is_active;
+CREATE INDEX IF NOT EXISTS otp_tokens_lookup_idx ON otp_tokens (email, token_type, expires_at) WHERE is_used = false;
+CREATE INDEX IF NOT EXISTS api_keys_user_active_idx ON api_keys (user_id) WHERE is_active;
+
 CREATE TABLE IF NOT EXISTS user_sessions (
     session_id SERIAL PRIMARY KEY,
     user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
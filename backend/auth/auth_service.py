@@ -6,8 +6,13 @@ Core authentication logic with JWT, OAuth2, OTP, and user management
 
 import os
 import secrets
-import string
 import hashlib
+import hmac
+import time
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any, List
 import uuid
@@ -17,16 +22,37 @@ from email.mime.multipart import MimeMultipart
 
 import jwt
 import bcrypt
+import orjson
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from fastapi import HTTPException, status
 
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
 # Configuration
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "argo_super_secret_key_2025_oceanographic_data_analysis_system_secure")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 30
 OTP_EXPIRE_MINUTES = 10
+OTP_MAX_ATTEMPTS = 5
+BCRYPT_COST = int(os.getenv("BCRYPT_COST", "12"))
+SALT_POOL_SIZE = 64
+API_KEY_PREFIX_LENGTH = 12
+API_KEY_PREFIX_REFRESH_SECONDS = 300
+API_KEY_PREFIX_MISS_RELOAD_SECONDS = 1  # A prefix miss reloads at most this often (keys made by other workers)
+JWT_CACHE_MAX_ENTRIES = 4096
+REVOKED_JTIS_MAX_ENTRIES = 10000  # In-process revocations when Redis is not configured
+LOGIN_MAX_ATTEMPTS = 3  # Failed password logins per email per window
+LOGIN_ATTEMPT_WINDOW_SECONDS = 600
+LOGIN_ATTEMPTS_MAX_ENTRIES = 10000  # In-process counters when Redis is not configured
+LOGIN_REJECT_DELAY_SECONDS = 0.25  # Roughly one bcrypt check, so rejections look like failures
+LOGIN_BLOCKLIST_PATH = os.getenv("LOGIN_BLOCKLIST_PATH")  # Hex login fingerprints, one per line
 
 # Google OAuth2 configuration
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
@@ -36,6 +62,26 @@ EMAIL_ADDRESS = os.getenv("EMAIL")
 
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL")
+REDIS_URL = os.getenv("REDIS_URL")
+DB_POOL_MIN_CONNECTIONS = 2
+DB_POOL_MAX_CONNECTIONS = 20
+DB_POOL_ACQUIRE_TIMEOUT_SECONDS = 5  # Wait for a free connection before answering 503
+DB_BUSY_RETRY_AFTER_SECONDS = 1
+
+class _ORJSONPyJWT(jwt.PyJWT):
+    """PyJWT codec that serializes claims with orjson instead of stdlib json"""
+    
+    def _encode_payload(self, payload: Dict[str, Any], headers=None, json_encoder=None) -> bytes:
+        return orjson.dumps(payload)
+    
+    def _decode_payload(self, decoded: Dict[str, Any]) -> Any:
+        try:
+            payload = orjson.loads(decoded["payload"])
+        except orjson.JSONDecodeError as e:
+            raise jwt.DecodeError(f"Invalid payload string: {e}")
+        if not isinstance(payload, dict):
+            raise jwt.DecodeError("Invalid payload string: must be a json object")
+        return payload
 
 class AuthenticationError(Exception):
     """Custom authentication error"""
@@ -46,33 +92,115 @@ class AuthService:
     
     def __init__(self):
         self.db_url = DATABASE_URL
+        # Reused PyJWT codec and encoded signing key instead of jwt.encode/decode per call
+        self._jwt = _ORJSONPyJWT()
+        self._jwt_key = SECRET_KEY.encode('utf-8')
+        self._bcrypt_cost = BCRYPT_COST
+        self._salt_queue = queue.Queue(maxsize=SALT_POOL_SIZE)
+        self._salt_worker = None
+        # OTPs live in Redis when configured; Postgres is the fallback store
+        self._redis = redis.Redis.from_url(REDIS_URL) if REDIS_AVAILABLE and REDIS_URL else None
+        self._pool = None
+        self._pool_lock = threading.RLock()
+        # getconn raises instead of waiting once every connection is leased,
+        # so callers queue here first
+        self._pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_CONNECTIONS)
+        self._known_key_prefixes = None  # Prefixes of active API keys
+        self._key_prefixes_loaded_at = 0.0
+        self._jwt_cache = OrderedDict()  # token fingerprint -> verified payload
+        self._jwt_cache_lock = threading.Lock()
+        self._revoked_jtis = OrderedDict()  # jti -> exp, fallback when Redis is not configured
+        self._revoked_jtis_lock = threading.Lock()
+        self._login_blocklist = self.load_login_blocklist(LOGIN_BLOCKLIST_PATH) if LOGIN_BLOCKLIST_PATH else frozenset()
+        self._login_attempts = OrderedDict()  # email -> (failures, window start)
+        self._login_attempts_lock = threading.Lock()
         
+    def _get_pool(self) -> ThreadedConnectionPool:
+        """Create the connection pool on first use"""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(
+                        DB_POOL_MIN_CONNECTIONS, DB_POOL_MAX_CONNECTIONS, dsn=self.db_url
+                    )
+        return self._pool
+    
+    @contextmanager
     def get_db_connection(self):
-        """Get database connection"""
+        """Lease a pooled database connection for the duration of a with-block.
+        Raises a retryable 503 when no connection frees up in time."""
+        if not self._pool_slots.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT_SECONDS):
+            raise self._database_busy()
+        
         try:
-            return psycopg2.connect(self.db_url)
-        except Exception as e:
-            raise AuthenticationError(f"Database connection failed: {e}")
+            try:
+                pool = self._get_pool()
+                conn = pool.getconn()
+            except PoolError:
+                raise self._database_busy()
+            except Exception as e:
+                raise AuthenticationError(f"Database connection failed: {e}")
+            
+            try:
+                yield conn
+            finally:
+                # putconn rolls back any transaction left open by the caller
+                pool.putconn(conn)
+        finally:
+            self._pool_slots.release()
+    
+    @staticmethod
+    def _database_busy() -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database busy, please retry",
+            headers={"Retry-After": str(DB_BUSY_RETRY_AFTER_SECONDS)}
+        )
 
     def hash_password(self, password: str) -> str:
         """Hash password using bcrypt"""
-        salt = bcrypt.gensalt()
+        # Callers already run in the threadpool and bcrypt releases the GIL while hashing
+        salt = self._next_salt()
         return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
     
+    def _next_salt(self) -> bytes:
+        """Take a pre-generated salt, generating one inline if the pool is empty"""
+        if self._salt_worker is None:
+            with self._pool_lock:
+                if self._salt_worker is None:
+                    self._salt_worker = threading.Thread(
+                        target=self._refill_salts, name="bcrypt-salts", daemon=True
+                    )
+                    self._salt_worker.start()
+        
+        try:
+            return self._salt_queue.get_nowait()
+        except queue.Empty:
+            return bcrypt.gensalt(rounds=self._bcrypt_cost)
+    
+    def _refill_salts(self):
+        """Keep the salt queue full; put() blocks while it is"""
+        while True:
+            self._salt_queue.put(bcrypt.gensalt(rounds=self._bcrypt_cost))
+    
     def verify_password(self, password: str, hashed_password: str) -> bool:
         """Verify password against hash"""
         return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
     
     def generate_otp(self, length: int = 6) -> str:
         """Generate OTP code"""
-        digits = string.digits
-        return ''.join(secrets.choice(digits) for _ in range(length))
+        # One CSPRNG draw, zero-padded; same distribution as per-digit choice
+        return f"{secrets.randbelow(10 ** length):0{length}d}"
     
     def generate_api_key(self) -> tuple:
-        """Generate API key and prefix"""
+        """Generate API key, prefix and the digest stored in place of the key"""
         key = 'argo_' + secrets.token_urlsafe(32)
-        prefix = key[:12]  # First 12 chars for display
-        return key, prefix
+        prefix = key[:API_KEY_PREFIX_LENGTH]  # First 12 chars for display
+        return key, prefix, self.hash_api_key(key)
+    
+    def hash_api_key(self, api_key: str) -> bytes:
+        """Digest used to store and look up API keys (SHA-256, matches migration 002)"""
+        return hashlib.sha256(api_key.encode('utf-8')).digest()
     
     def create_jwt_token(self, user_id: str, email: str, token_type: str = "access") -> str:
         """Create JWT token"""
@@ -92,17 +220,73 @@ class AuthService:
             "jti": secrets.token_urlsafe(16)
         }
         
-        return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+        return self._jwt.encode(payload, self._jwt_key, algorithm=ALGORITHM)
     
     def verify_jwt_token(self, token: str) -> Dict[str, Any]:
-        """Verify and decode JWT token"""
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            return payload
-        except jwt.ExpiredSignatureError:
+        """Verify and decode JWT token (verified payloads are cached until expiry)"""
+        fingerprint = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        
+        with self._jwt_cache_lock:
+            payload = self._jwt_cache.get(fingerprint)
+            if payload is not None:
+                self._jwt_cache.move_to_end(fingerprint)
+        
+        if payload is None:
+            try:
+                payload = self._jwt.decode(token, self._jwt_key, algorithms=[ALGORITHM])
+            except jwt.ExpiredSignatureError:
+                raise AuthenticationError("Token has expired")
+            except jwt.InvalidTokenError:
+                raise AuthenticationError("Invalid token")
+            
+            with self._jwt_cache_lock:
+                self._jwt_cache[fingerprint] = payload
+                if len(self._jwt_cache) > JWT_CACHE_MAX_ENTRIES:
+                    self._jwt_cache.popitem(last=False)
+        elif payload["exp"] <= time.time():
+            with self._jwt_cache_lock:
+                self._jwt_cache.pop(fingerprint, None)
             raise AuthenticationError("Token has expired")
-        except jwt.JWTError:
-            raise AuthenticationError("Invalid token")
+        
+        if self._is_jti_revoked(payload.get("jti")):
+            raise AuthenticationError("Token has been revoked")
+        
+        return payload
+    
+    def _is_jti_revoked(self, jti: Optional[str]) -> bool:
+        """Check the in-process revocations, then Redis so every worker sees a logout"""
+        if not jti:
+            return False
+        if jti in self._revoked_jtis:
+            return True
+        if self._redis is not None:
+            try:
+                return bool(self._redis.exists(f"revoked_jti:{jti}"))
+            except redis.RedisError:
+                return False  # Fail open; the signature and expiry were still checked
+        return False
+    
+    def revoke_jwt_token(self, token: str):
+        """Revoke a token until it expires (logout)"""
+        payload = self.verify_jwt_token(token)
+        jti, exp = payload["jti"], payload["exp"]
+        
+        if self._redis is not None:
+            try:
+                self._redis.set(f"revoked_jti:{jti}", 1, ex=max(1, int(exp - time.time())))
+                return
+            except redis.RedisError as e:
+                print(f" Failed to store token revocation, keeping it in-process: {e}")
+        
+        now = time.time()
+        with self._revoked_jtis_lock:
+            # Expired tokens fail verification anyway, so their entries can go
+            for revoked_jti, revoked_exp in list(self._revoked_jtis.items()):
+                if revoked_exp <= now:
+                    del self._revoked_jtis[revoked_jti]
+            self._revoked_jtis[jti] = exp
+            if len(self._revoked_jtis) > REVOKED_JTIS_MAX_ENTRIES:
+                self._revoked_jtis.popitem(last=False)
     
     def send_otp_email(self, email: str, otp_code: str, purpose: str = "verification"):
         """Send OTP via email (simplified version)"""
@@ -115,80 +299,182 @@ class AuthService:
             return False
     
     def create_user(self, email: str, username: str = None, password: str = None, 
-                   full_name: str = None, google_id: str = None, avatar_url: str = None) -> str:
-        """Create new user account"""
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
+                   full_name: str = None, google_id: str = None, avatar_url: str = None) -> Dict[str, Any]:
+        """Create new user account and return the inserted user row"""
+        user_id = str(uuid.uuid4())
         
-        try:
-            user_id = str(uuid.uuid4())
-            
-            # Hash password if provided
-            hashed_password = self.hash_password(password) if password else None
-            
-            cursor.execute("""
-                INSERT INTO users (id, email, username, password_hash, first_name, last_name, 
-                                 google_id, avatar_url, user_tier, is_active, is_verified)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
-            """, (user_id, email, username, hashed_password, 
-                  full_name.split()[0] if full_name else None,
-                  ' '.join(full_name.split()[1:]) if full_name and len(full_name.split()) > 1 else None,
-                  google_id, avatar_url, 'standard', True, google_id is not None))
-            
-            created_id = cursor.fetchone()[0]
-            conn.commit()
-            
-            return str(created_id)
-            
-        except psycopg2.IntegrityError as e:
-            conn.rollback()
-            if "email" in str(e):
-                raise AuthenticationError("Email already registered")
-            elif "username" in str(e):
-                raise AuthenticationError("Username already taken")
-            else:
-                raise AuthenticationError("User creation failed")
-        finally:
-            conn.close()
+        # Hash password if provided
+        hashed_password = self.hash_password(password) if password else None
+        
+        # Split the display name once into first / last
+        name_parts = full_name.split() if full_name else []
+        first_name = name_parts[0] if name_parts else None
+        last_name = ' '.join(name_parts[1:]) if len(name_parts) > 1 else None
+        
+        with self.get_db_connection() as conn:
+            try:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                cursor.execute("""
+                    INSERT INTO users (id, email, username, password_hash, first_name, last_name, 
+                                     google_id, avatar_url, user_tier, is_active, is_verified)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id, email, username, first_name, last_name, user_tier,
+                              is_active, is_verified, created_at
+                """, (user_id, email, username, hashed_password, 
+                      first_name, last_name,
+                      google_id, avatar_url, 'standard', True, google_id is not None))
+                
+                user = dict(cursor.fetchone())
+                conn.commit()
+                
+                user["id"] = str(user["id"])
+                return user
+                
+            except psycopg2.IntegrityError as e:
+                conn.rollback()
+                if "email" in str(e):
+                    raise AuthenticationError("Email already registered")
+                elif "username" in str(e):
+                    raise AuthenticationError("Username already taken")
+                else:
+                    raise AuthenticationError("User creation failed")
     
     def authenticate_user(self, email: str, password: str) -> Optional[Dict[str, Any]]:
         """Authenticate user with email and password"""
-        conn = self.get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cursor.execute("""
-            SELECT id, email, username, password_hash, first_name, last_name, 
-                   is_active, is_verified, user_tier, google_id
-            FROM users WHERE email = %s AND is_active = true
-        """, (email,))
-        
-        user = cursor.fetchone()
-        conn.close()
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("""
+                SELECT id, email, username, password_hash, first_name, last_name, 
+                       is_active, is_verified, user_tier, google_id
+                FROM users WHERE email = %s AND is_active = true
+            """, (email,))
+            
+            user = cursor.fetchone()
         
         if not user or not user['password_hash']:
+            self._record_failed_login(email)
             return None
-            
-        if not self.verify_password(password, user['password_hash']):
+        
+        hash_bytes = user['password_hash'].encode('ascii')
+        if not bcrypt.checkpw(password.encode('utf-8'), hash_bytes):
+            self._record_failed_login(email)
             return None
+        
+        self._clear_failed_logins(email)
+        
+        # Upgrade hashes created with a lower cost than currently configured
+        if int(hash_bytes[4:6]) < self._bcrypt_cost:
+            threading.Thread(
+                target=self._rehash_password, args=(user['id'], password), daemon=True
+            ).start()
             
         return dict(user)
     
+    def _rehash_password(self, user_id: str, password: str):
+        """Store a new hash of password at the configured bcrypt cost"""
+        try:
+            hashed_password = self.hash_password(password)
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE users SET password_hash = %s WHERE id = %s
+                """, (hashed_password, user_id))
+                conn.commit()
+        except (AuthenticationError, HTTPException, psycopg2.Error) as e:
+            print(f" Failed to rehash password for {user_id}: {e}")
+    
+    @staticmethod
+    def login_fingerprint(email: str, client_ip: str) -> bytes:
+        """Digest of an (email, client IP) pair as stored in the login blocklist"""
+        return hashlib.blake2b(f"{email.strip().lower()}|{client_ip}".encode(), digest_size=16).digest()
+    
+    def load_login_blocklist(self, path: str) -> frozenset:
+        """Load the dumped list of abusive login fingerprints"""
+        try:
+            with open(path, encoding='ascii') as f:
+                return frozenset(bytes.fromhex(line.strip()) for line in f if line.strip())
+        except (OSError, ValueError) as e:
+            print(f" Failed to load login blocklist {path}: {e}")
+            return frozenset()
+    
+    def is_login_blocked(self, email: str, client_ip: str) -> bool:
+        """Reject known-abusive callers and emails over their failed-login budget"""
+        if self._login_blocklist and self.login_fingerprint(email, client_ip) in self._login_blocklist:
+            return True
+        return self._failed_login_count(email) >= LOGIN_MAX_ATTEMPTS
+    
+    def _failed_login_count(self, email: str) -> int:
+        """Failed password logins for email in the current window"""
+        email = email.strip().lower()
+        if self._redis is not None:
+            try:
+                return int(self._redis.get(f"login_attempts:{email}") or 0)
+            except redis.RedisError:
+                return 0  # Fail open; bcrypt still guards the password
+        
+        with self._login_attempts_lock:
+            failures, window_start = self._login_attempts.get(email, (0, 0.0))
+        if time.time() - window_start > LOGIN_ATTEMPT_WINDOW_SECONDS:
+            return 0
+        return failures
+    
+    def _record_failed_login(self, email: str):
+        """Count a failed password login against email"""
+        email = email.strip().lower()
+        if self._redis is not None:
+            key = f"login_attempts:{email}"
+            try:
+                if self._redis.incr(key) == 1:
+                    self._redis.expire(key, LOGIN_ATTEMPT_WINDOW_SECONDS)
+            except redis.RedisError as e:
+                print(f" Failed to record login attempt for {email}: {e}")
+            return
+        
+        now = time.time()
+        with self._login_attempts_lock:
+            failures, window_start = self._login_attempts.pop(email, (0, now))
+            if now - window_start > LOGIN_ATTEMPT_WINDOW_SECONDS:
+                failures, window_start = 0, now
+            self._login_attempts[email] = (failures + 1, window_start)
+            if len(self._login_attempts) > LOGIN_ATTEMPTS_MAX_ENTRIES:
+                self._login_attempts.popitem(last=False)
+    
+    def _clear_failed_logins(self, email: str):
+        """Reset the failed-login budget after a successful login"""
+        email = email.strip().lower()
+        if self._redis is not None:
+            try:
+                self._redis.delete(f"login_attempts:{email}")
+            except redis.RedisError:
+                pass
+            return
+        
+        with self._login_attempts_lock:
+            self._login_attempts.pop(email, None)
+    
     def create_otp_token(self, email: str, token_type: str, user_id: str = None) -> str:
         """Create and send OTP token"""
         otp_code = self.generate_otp()
         expires_at = datetime.now(timezone.utc) + timedelta(minutes=OTP_EXPIRE_MINUTES)
         
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO otp_tokens (user_id, email, otp_code, token_type, expires_at)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (user_id, email, otp_code, token_type, expires_at))
-        
-        conn.commit()
-        conn.close()
+        if self._redis is not None:
+            code_key, attempts_key = self._otp_keys(email, token_type)
+            try:
+                pipe = self._redis.pipeline()
+                pipe.set(code_key, otp_code, ex=OTP_EXPIRE_MINUTES * 60)
+                pipe.set(attempts_key, OTP_MAX_ATTEMPTS, ex=OTP_EXPIRE_MINUTES * 60)
+                pipe.execute()
+            except redis.RedisError as e:
+                raise AuthenticationError(f"OTP store unavailable: {e}")
+            
+            # Postgres only keeps an audit trail, written off the request path
+            threading.Thread(
+                target=self._insert_otp_record,
+                args=(user_id, email, otp_code, token_type, expires_at),
+                daemon=True
+            ).start()
+        else:
+            self._insert_otp_record(user_id, email, otp_code, token_type, expires_at)
         
         # Send OTP via email
         if self.send_otp_email(email, otp_code, token_type):
@@ -196,48 +482,98 @@ class AuthService:
         else:
             raise AuthenticationError("Failed to send OTP email")
     
+    def _otp_keys(self, email: str, token_type: str) -> tuple:
+        """Redis keys holding the OTP code and its remaining attempts"""
+        token_type = getattr(token_type, "value", token_type)
+        return f"otp:{token_type}:{email}", f"otp_attempts:{token_type}:{email}"
+    
+    def _insert_otp_record(self, user_id: str, email: str, otp_code: str, token_type: str,
+                           expires_at: datetime):
+        """Insert OTP row into Postgres"""
+        try:
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO otp_tokens (user_id, email, otp_code, token_type, expires_at)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, (user_id, email, otp_code, token_type, expires_at))
+                conn.commit()
+        except (AuthenticationError, HTTPException, psycopg2.Error):
+            if self._redis is None:
+                raise  # Postgres is the OTP store, so the failure matters
+            print(f" Failed to write OTP audit record for {email}")
+    
     def verify_otp_token(self, email: str, otp_code: str, token_type: str) -> bool:
         """Verify OTP token"""
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT token_id FROM otp_tokens 
-            WHERE email = %s AND otp_code = %s AND token_type = %s 
-            AND expires_at > %s AND is_used = false
-        """, (email, otp_code, token_type, datetime.now(timezone.utc)))
+        if self._redis is not None:
+            return self._verify_otp_in_redis(email, otp_code, token_type)
         
-        token = cursor.fetchone()
-        
-        if token:
-            # Mark token as used
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("""
-                UPDATE otp_tokens SET is_used = true, used_at = %s 
-                WHERE token_id = %s
-            """, (datetime.now(timezone.utc), token[0]))
+                SELECT token_id, otp_code FROM otp_tokens 
+                WHERE email = %s AND token_type = %s 
+                AND expires_at > NOW() AND is_used = false
+            """, (email, token_type))
+            
+            # Compare codes in constant time rather than matching them in SQL
+            token_id = None
+            otp_bytes = otp_code.encode('utf-8')
+            for candidate_id, candidate_code in cursor.fetchall():
+                if hmac.compare_digest(candidate_code.encode('utf-8'), otp_bytes):
+                    token_id = candidate_id
+            
+            if token_id is None:
+                return False
+            
+            # Consume the token atomically: a concurrent verify that already
+            # marked it used makes this UPDATE match nothing
+            cursor.execute("""
+                UPDATE otp_tokens SET is_used = true, used_at = NOW() 
+                WHERE token_id = %s AND is_used = false AND expires_at > NOW()
+                RETURNING token_id
+            """, (token_id,))
+            consumed = cursor.fetchone() is not None
             conn.commit()
-            conn.close()
-            return True
-        else:
-            conn.close()
+            return consumed
+    
+    def _verify_otp_in_redis(self, email: str, otp_code: str, token_type: str) -> bool:
+        """Verify OTP against Redis, burning one attempt on each mismatch"""
+        code_key, attempts_key = self._otp_keys(email, token_type)
+        try:
+            stored_code = self._redis.get(code_key)
+            if stored_code is None:
+                return False
+            
+            if hmac.compare_digest(stored_code, otp_code.encode('utf-8')):
+                # Only the request that actually deletes the code may use it
+                consumed = self._redis.delete(code_key) == 1
+                self._redis.delete(attempts_key)
+                return consumed
+            
+            if self._redis.decr(attempts_key) <= 0:
+                self._redis.delete(code_key)
             return False
+        except redis.RedisError as e:
+            raise AuthenticationError(f"OTP store unavailable: {e}")
     
     def create_api_key(self, user_id: str, key_name: str) -> Dict[str, str]:
         """Create API key for user"""
-        api_key, prefix = self.generate_api_key()
-        
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
+        api_key, prefix, key_hash = self.generate_api_key()
         
-        cursor.execute("""
-            INSERT INTO api_keys (user_id, key_name, api_key, key_prefix)
-            VALUES (%s, %s, %s, %s)
-            RETURNING key_id
-        """, (user_id, key_name, api_key, prefix))
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO api_keys (user_id, key_name, api_key_hash, key_prefix)
+                VALUES (%s, %s, %s, %s)
+                RETURNING key_id
+            """, (user_id, key_name, key_hash, prefix))
+            
+            key_id = cursor.fetchone()[0]
+            conn.commit()
         
-        key_id = cursor.fetchone()[0]
-        conn.commit()
-        conn.close()
+        if self._known_key_prefixes is not None:
+            self._known_key_prefixes.add(prefix)
         
         return {
             "key_id": key_id,
@@ -246,32 +582,66 @@ class AuthService:
             "key_name": key_name
         }
     
+    def load_api_key_prefixes(self):
+        """Load prefixes of all active API keys into memory"""
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT key_prefix FROM api_keys WHERE is_active = true")
+            self._known_key_prefixes = {row[0] for row in cursor.fetchall()}
+            self._key_prefixes_loaded_at = time.time()
+    
+    def reload_api_key_prefixes(self):
+        """Reload the prefix set (blocking; async callers run it in a thread).
+        Failed reloads are timestamped too so retries stay throttled."""
+        self._key_prefixes_loaded_at = time.time()
+        try:
+            self.load_api_key_prefixes()
+        except (AuthenticationError, HTTPException, psycopg2.Error):
+            pass
+    
+    def api_key_prefixes_stale(self) -> bool:
+        """True once the prefix set is older than API_KEY_PREFIX_REFRESH_SECONDS"""
+        return time.time() - self._key_prefixes_loaded_at > API_KEY_PREFIX_REFRESH_SECONDS
+    
+    def api_key_prefix_miss_reload_allowed(self) -> bool:
+        """A prefix miss may trigger a reload at most every API_KEY_PREFIX_MISS_RELOAD_SECONDS"""
+        return time.time() - self._key_prefixes_loaded_at > API_KEY_PREFIX_MISS_RELOAD_SECONDS
+    
+    def is_known_api_key_prefix(self, api_key: str) -> bool:
+        """Cheap in-memory pre-check so junk keys never reach verify_api_key; never queries"""
+        if self._known_key_prefixes is None:
+            return True  # Prefixes unavailable, fall back to full verification
+        return api_key[:API_KEY_PREFIX_LENGTH] in self._known_key_prefixes
+    
     def verify_api_key(self, api_key: str) -> Optional[Dict[str, Any]]:
         """Verify API key and return user info"""
-        conn = self.get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        key_hash = self.hash_api_key(api_key)
         
-        cursor.execute("""
-            SELECT ak.user_id, ak.key_name, ak.permissions, ak.usage_count,
-                   u.email, u.user_tier, u.is_active
-            FROM api_keys ak
-            JOIN users u ON ak.user_id = u.id
-            WHERE ak.api_key = %s AND ak.is_active = true AND u.is_active = true
-        """, (api_key,))
-        
-        result = cursor.fetchone()
-        
-        if result:
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("""
+                SELECT ak.key_id, ak.api_key_hash, ak.user_id, ak.key_name, ak.permissions,
+                       ak.usage_count, u.email, u.user_tier, u.is_active, u.created_at
+                FROM api_keys ak
+                JOIN users u ON ak.user_id = u.id
+                WHERE ak.api_key_hash = %s AND ak.is_active = true AND u.is_active = true
+            """, (key_hash,))
+            
+            result = cursor.fetchone()
+            if not result or not hmac.compare_digest(bytes(result['api_key_hash']), key_hash):
+                return None
+            
             # Update usage count and last used
             cursor.execute("""
                 UPDATE api_keys 
                 SET usage_count = usage_count + 1, last_used = %s
-                WHERE api_key = %s
-            """, (datetime.now(timezone.utc), api_key))
+                WHERE key_id = %s
+            """, (datetime.now(timezone.utc), result['key_id']))
             conn.commit()
         
-        conn.close()
-        return dict(result) if result else None
+        result = dict(result)
+        del result['api_key_hash']
+        return result
 
 # Global auth service instance
 auth_service = AuthService()
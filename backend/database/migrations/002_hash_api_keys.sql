@@ -0,0 +1,24 @@
+﻿-- ===============================================
+-- MIGRATION SCRIPT: Store API keys as SHA-256 digests
+-- Look-ups go through a 32-byte BYTEA column instead of the raw key
+-- ===============================================
+
+BEGIN;
+
+-- Add digest column and backfill it from the existing plaintext keys
+ALTER TABLE api_keys ADD COLUMN IF NOT EXISTS api_key_hash BYTEA;
+
+UPDATE api_keys
+SET api_key_hash = sha256(convert_to(api_key, 'UTF8'))
+WHERE api_key_hash IS NULL AND api_key IS NOT NULL;
+
+ALTER TABLE api_keys ALTER COLUMN api_key_hash SET NOT NULL;
+
+-- Stop keeping plaintext keys
+ALTER TABLE api_keys DROP COLUMN IF EXISTS api_key;
+
+COMMIT;
+
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_api_keys_api_key_hash
+    ON api_keys (api_key_hash);
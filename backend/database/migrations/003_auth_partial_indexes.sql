@@ -0,0 +1,20 @@
+﻿-- ===============================================
+-- MIGRATION SCRIPT: Partial indexes for auth look-ups
+-- Index only the rows the hot auth queries can match
+-- ===============================================
+
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block,
+-- so each statement runs on its own
+
+-- authenticate_user: WHERE email = %s AND is_active = true
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_email_active_idx
+    ON users (email) WHERE is_active;
+
+-- verify_otp_token: WHERE email = %s AND token_type = %s
+--                   AND expires_at > NOW() AND is_used = false
+CREATE INDEX CONCURRENTLY IF NOT EXISTS otp_tokens_lookup_idx
+    ON otp_tokens (email, token_type, expires_at) WHERE is_used = false;
+
+-- /auth/stats: COUNT(*) FROM api_keys WHERE user_id = %s AND is_active = true
+CREATE INDEX CONCURRENTLY IF NOT EXISTS api_keys_user_active_idx
+    ON api_keys (user_id) WHERE is_active;
@@ -0,0 +1,11 @@
+﻿-- ===============================================
+-- MIGRATION SCRIPT: Index profile_embeddings.profile_id
+-- Lets the "profiles without embeddings" anti-join probe an index
+-- ===============================================
+
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+
+-- embedding_generator: WHERE NOT EXISTS (... WHERE pe.profile_id = ap.profile_id::text)
+-- search joins:        JOIN profile_embeddings pe ON ap.profile_id::text = pe.profile_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_profile_embeddings_profile_id
+    ON profile_embeddings (profile_id);
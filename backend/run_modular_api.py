@@ -1,15 +1,28 @@
 """
 Alternative runner for ARGO API - run from backend directory
+
+Set ARGO_DEV=1 for auto-reload during development; otherwise the API runs
+ARGO_WORKERS worker processes (default 4) on uvloop + httptools.
 """
+import os
+import sys
 import uvicorn
 
 if __name__ == "__main__":
+    dev_mode = os.getenv("ARGO_DEV") == "1"
+    # uvloop is not available on Windows; uvicorn[standard] installs it everywhere else
+    loop = "asyncio" if sys.platform == "win32" else "uvloop"
+
     print("🌊 Starting ARGO Oceanographic RAG API (Modular Version)...")
     print("📁 Running from backend directory...")
     uvicorn.run(
         "api_modules.api:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        reload=dev_mode,
+        # The reloader supervises a single process, so workers only apply outside dev mode
+        workers=1 if dev_mode else int(os.getenv("ARGO_WORKERS", "4")),
+        loop=loop,
+        http="httptools",
         log_level="info"
-    )
\ No newline at end of file
+    )
@@ -7,18 +7,15 @@ query = 'depth of indian ocean in 2008'
 print(f'Testing query: "{query}"')
 print()
 
-# Debug measurement extraction
+# Debug measurement extraction: one scan of the query reports every keyword hit
 found_types = []
-for measurement_type, keywords in nlp_system.measurement_keywords.items():
-    print(f'Checking {measurement_type.value}: {keywords}')
-    for keyword in keywords:
-        if keyword in query:
-            print(f'  ✓ Found keyword: "{keyword}"')
-            if measurement_type not in found_types:
-                found_types.append(measurement_type)
-            break
-    else:
-        print(f'  ✗ No match')
+for measurement_type, keyword in nlp_system.iter_measurement_matches(query.lower()):
+    print(f'  ✓ Found keyword: "{keyword}" ({measurement_type.value})')
+    if measurement_type not in found_types:
+        found_types.append(measurement_type)
+
+if not found_types:
+    print(f'  ✗ No match')
 
 print()
 print(f'Final measurements found: {[mt.value for mt in found_types]}')
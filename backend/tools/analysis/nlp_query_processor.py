@@ -5,19 +5,75 @@ Intelligent parsing of natural language queries for oceanographic data retrieval
 """
 
 import re
-import spacy
+import functools
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple, Any
 from dataclasses import dataclass
 from enum import Enum
-import dateparser
 
-# Load spaCy model (install with: python -m spacy download en_core_web_sm)
 try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    print("Warning: spaCy model not found. Install with: python -m spacy download en_core_web_sm")
-    nlp = None
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+PARSE_CACHE_SIZE = 1024  # Distinct query texts kept by parse_query
+
+MONTHS = {
+    'january': 1, 'february': 2, 'march': 3, 'april': 4,
+    'may': 5, 'june': 6, 'july': 7, 'august': 8,
+    'september': 9, 'october': 10, 'november': 11, 'december': 12
+}
+
+# Season -> (first month, last month, year offset of the last month); winter runs Dec-Feb
+SEASONS = {
+    'spring': (3, 5, 0), 'summer': (6, 8, 0), 'autumn': (9, 11, 0), 'fall': (9, 11, 0),
+    'winter': (12, 2, 1)
+}
+
+# Extractors receive the lower-cased query, so no pattern needs re.IGNORECASE
+
+# Every supported date form in one alternation; the named group tells which form matched
+TEMPORAL_RE = re.compile(
+    r'\b(?:'
+    r'(?P<iso_year>\d{4})-(?P<iso_month>\d{1,2})-(?P<iso_day>\d{1,2})'
+    r'|(?P<month>' + '|'.join(MONTHS) + r')\s+(?P<month_year>\d{4})'
+    r'|(?P<season>' + '|'.join(SEASONS) + r')\s+(?P<season_year>\d{4})'
+    r'|(?P<num_month>\d{1,2})[/\-](?P<num_month_year>\d{4})'
+    r'|(?P<year>\d{4})'
+    r')\b'
+)
+# When a query holds several forms, the most specific one wins
+TEMPORAL_PRIORITY = ('iso_year', 'month', 'num_month', 'season', 'year')
+
+# Keyword extraction: POS tags kept by spaCy, stop words and tokenizer for the fallback
+KEYWORD_POS = frozenset({'NOUN', 'ADJ', 'PROPN'})
+BASIC_STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
+    'of', 'with', 'by', 'what', 'was', 'were', 'is', 'are', 'how'
+})
+WORD_RE = re.compile(r'\b\w+\b')
+COORD_RE = re.compile(r'(-?\d+\.?\d*)[\s]*([ns])[,\s]*(-?\d+\.?\d*)[\s]*([ew])')
+
+def _month_end(year: int, month: int) -> datetime:
+    """Last day of the given month"""
+    if month == 12:
+        return datetime(year + 1, 1, 1) - timedelta(days=1)
+    return datetime(year, month + 1, 1) - timedelta(days=1)
+
+@functools.cache
+def _get_nlp():
+    """Load the spaCy model on first use, so importing this module stays cheap"""
+    import spacy
+    
+    # Load spaCy model (install with: python -m spacy download en_core_web_sm)
+    try:
+        # Keyword extraction only reads POS, lemma and stop/punct flags. tok2vec, tagger,
+        # attribute_ruler (tag -> POS) and lemmatizer provide those; parser and NER do not
+        return spacy.load("en_core_web_sm", disable=["parser", "ner"])
+    except OSError:
+        print("Warning: spaCy model not found. Install with: python -m spacy download en_core_web_sm")
+        return None
 
 class QueryType(Enum):
     """Types of oceanographic queries"""
@@ -66,6 +122,12 @@ class QueryIntent:
     keywords: List[str] = None
     confidence: float = 0.0
 
+def _is_word_boundary(text: str, pos: int) -> bool:
+    """Same test as regex \\b: word-ness changes between text[pos - 1] and text[pos]"""
+    before = pos > 0 and (text[pos - 1].isalnum() or text[pos - 1] == '_')
+    after = pos < len(text) and (text[pos].isalnum() or text[pos] == '_')
+    return before != after
+
 class OceanographicNLP:
     """NLP system for understanding oceanographic queries"""
     
@@ -73,7 +135,14 @@ class OceanographicNLP:
         self.ocean_regions = self._load_ocean_regions()
         self.measurement_keywords = self._load_measurement_keywords()
         self.statistical_keywords = self._load_statistical_keywords()
-        self.temporal_patterns = self._load_temporal_patterns()
+        self.measurement_automaton = self._build_measurement_automaton()
+        self.region_automaton = self._build_keyword_automaton(self.ocean_regions)
+        self.statistical_automaton = self._build_keyword_automaton(self.statistical_keywords)
+        # Fallback when pyahocorasick is missing: one compiled alternation per type
+        self.measurement_patterns = {
+            measurement_type: re.compile(r'\b(?:' + '|'.join(re.escape(k) for k in keywords) + r')\b')
+            for measurement_type, keywords in self.measurement_keywords.items()
+        }
     
     def _load_ocean_regions(self) -> Dict[str, GeographicBounds]:
         """Load predefined ocean region boundaries"""
@@ -110,6 +179,37 @@ class OceanographicNLP:
             ]
         }
     
+    def _build_measurement_automaton(self):
+        """Build one Aho-Corasick automaton over every measurement keyword"""
+        if not AHOCORASICK_AVAILABLE:
+            return None
+        
+        automaton = ahocorasick.Automaton()
+        for measurement_type, keywords in self.measurement_keywords.items():
+            for keyword in keywords:
+                # A keyword listed under several types keeps every owner
+                owners = automaton.get(keyword, ())
+                automaton.add_word(keyword, owners + ((measurement_type, keyword),))
+        automaton.make_automaton()
+        return automaton
+    
+    def _build_keyword_automaton(self, keywords):
+        """Aho-Corasick automaton that reports each plain keyword it finds"""
+        if not AHOCORASICK_AVAILABLE:
+            return None
+        
+        automaton = ahocorasick.Automaton()
+        for keyword in keywords:
+            automaton.add_word(keyword, keyword)
+        automaton.make_automaton()
+        return automaton
+    
+    def _find_keywords(self, automaton, keywords, query: str) -> set:
+        """Keywords occurring anywhere in query, found in one scan when an automaton is available"""
+        if automaton is None:
+            return {keyword for keyword in keywords if keyword in query}
+        return {keyword for _, keyword in automaton.iter(query)}
+    
     def _load_statistical_keywords(self) -> List[str]:
         """Load statistical operation keywords"""
         return [
@@ -119,18 +219,48 @@ class OceanographicNLP:
             "compare", "comparison", "difference", "correlation"
         ]
     
-    def _load_temporal_patterns(self) -> List[str]:
-        """Load temporal pattern regex"""
-        return [
-            r'\b(january|february|march|april|may|june|july|august|september|october|november|december)\s+(\d{4})\b',
-            r'\b(\d{4})\b',
-            r'\b(spring|summer|autumn|fall|winter)\s+(\d{4})\b',
-            r'\b(\d{1,2})[\/\-](\d{4})\b',
-            r'\b(last|past)\s+(\d+)\s+(years?|months?|days?)\b'
-        ]
-    
     def parse_query(self, query: str) -> QueryIntent:
-        """Parse natural language query into structured intent"""
+        """Parse natural language query into structured intent
+        
+        Results are cached by query text and shared across calls and instances,
+        so callers must treat the returned intent as read-only.
+        """
+        return _parse_query_cached(query)
+    
+    def _parse_query_uncached(self, query: str) -> QueryIntent:
+        """Full parse of one query: regex extraction, keywords and confidence"""
+        intent = self._parse_structured(query)
+        
+        # Extract keywords using spaCy if available
+        if _get_nlp():
+            intent.keywords = self._extract_keywords_spacy(query)
+        else:
+            intent.keywords = self._extract_keywords_basic(query.lower().strip())
+        
+        # Calculate confidence
+        intent.confidence = self._calculate_confidence(intent)
+        
+        return intent
+    
+    def parse_queries(self, queries: List[str]) -> List[QueryIntent]:
+        """Parse many queries at once; spaCy processes them as one nlp.pipe stream"""
+        intents = [self._parse_structured(query) for query in queries]
+        
+        nlp = _get_nlp()
+        if nlp:
+            for intent, doc in zip(intents, nlp.pipe(queries, batch_size=64)):
+                intent.keywords = self._keywords_from_doc(doc)
+        else:
+            for intent, query in zip(intents, queries):
+                intent.keywords = self._extract_keywords_basic(query.lower().strip())
+        
+        for intent in intents:
+            intent.confidence = self._calculate_confidence(intent)
+        
+        return intents
+    
+    def _parse_structured(self, query: str) -> QueryIntent:
+        """Regex/lookup part of parsing: everything except keywords and confidence"""
         query_lower = query.lower().strip()
         
         # Initialize intent
@@ -166,32 +296,23 @@ class OceanographicNLP:
             intent.statistical_operations = statistical_ops
             intent.query_types.append(QueryType.STATISTICAL)
         
-        # Extract keywords using spaCy if available
-        if nlp:
-            intent.keywords = self._extract_keywords_spacy(query)
-        else:
-            intent.keywords = self._extract_keywords_basic(query_lower)
-        
-        # Calculate confidence
-        intent.confidence = self._calculate_confidence(intent)
-        
         return intent
     
     def _extract_geographic_bounds(self, query: str) -> Optional[GeographicBounds]:
         """Extract geographic boundaries from query"""
+        found_regions = self._find_keywords(self.region_automaton, self.ocean_regions, query)
         for region_name, bounds in self.ocean_regions.items():
-            if region_name in query:
+            if region_name in found_regions:
                 return bounds
         
         # Look for coordinate patterns
-        coord_pattern = r'(-?\d+\.?\d*)[\s]*([ns])[,\s]*(-?\d+\.?\d*)[\s]*([ew])'
-        matches = re.findall(coord_pattern, query, re.IGNORECASE)
+        matches = COORD_RE.findall(query)
         
         if matches:
             # Create custom bounds from coordinates
             lat, lat_dir, lon, lon_dir = matches[0]
-            lat_val = float(lat) * (-1 if lat_dir.lower() == 's' else 1)
-            lon_val = float(lon) * (-1 if lon_dir.lower() == 'w' else 1)
+            lat_val = float(lat) * (-1 if lat_dir == 's' else 1)
+            lon_val = float(lon) * (-1 if lon_dir == 'w' else 1)
             
             # Create a small region around the point
             return GeographicBounds(
@@ -204,112 +325,128 @@ class OceanographicNLP:
     
     def _extract_temporal_filter(self, query: str) -> Optional[TemporalFilter]:
         """Extract temporal filter from query"""
+        # One scan of the query, keeping the first match of each date form
+        found = {}
+        for match in TEMPORAL_RE.finditer(query):
+            kind = next(k for k in TEMPORAL_PRIORITY if match.group(k) is not None)
+            if kind == 'year' and not 1950 <= int(match.group('year')) <= 2030:
+                continue
+            found.setdefault(kind, match)
+        
+        for kind in TEMPORAL_PRIORITY:
+            if kind in found:
+                temporal_filter = self._parse_date_fast(kind, found[kind])
+                if temporal_filter:
+                    return temporal_filter
+        
+        return None
+    
+    def _parse_date_fast(self, kind: str, match: re.Match) -> Optional[TemporalFilter]:
+        """Turn one TEMPORAL_RE match into a date range"""
         temporal_filter = TemporalFilter()
         
-        # Month-Year pattern (July 2004)
-        month_year_pattern = r'\b(january|february|march|april|may|june|july|august|september|october|november|december)\s+(\d{4})\b'
-        match = re.search(month_year_pattern, query, re.IGNORECASE)
-        
-        if match:
-            month_name, year = match.groups()
-            month_map = {
-                'january': 1, 'february': 2, 'march': 3, 'april': 4,
-                'may': 5, 'june': 6, 'july': 7, 'august': 8,
-                'september': 9, 'october': 10, 'november': 11, 'december': 12
-            }
-            
-            temporal_filter.month = month_map[month_name.lower()]
-            temporal_filter.year = int(year)
-            
-            # Create date range for the entire month
-            temporal_filter.start_date = datetime(int(year), temporal_filter.month, 1)
-            if temporal_filter.month == 12:
-                temporal_filter.end_date = datetime(int(year) + 1, 1, 1) - timedelta(days=1)
-            else:
-                temporal_filter.end_date = datetime(int(year), temporal_filter.month + 1, 1) - timedelta(days=1)
-            
+        if kind == 'iso_year':
+            try:
+                day = datetime(int(match.group('iso_year')), int(match.group('iso_month')), int(match.group('iso_day')))
+            except ValueError:
+                # Impossible day (2004-02-30): the match consumed the year, so fall back to it here
+                year = int(match.group('iso_year'))
+                return self._year_filter(year) if 1950 <= year <= 2030 else None
+            if not 1950 <= day.year <= 2030:
+                return None
+            temporal_filter.start_date = temporal_filter.end_date = day
+            temporal_filter.year = day.year
+            temporal_filter.month = day.month
             return temporal_filter
         
-        # Year only pattern
-        year_pattern = r'\b(\d{4})\b'
-        matches = re.findall(year_pattern, query)
+        if kind == 'month' or kind == 'num_month':
+            # Month-Year pattern (July 2004, 07/2004)
+            if kind == 'month':
+                month, year = MONTHS[match.group('month')], int(match.group('month_year'))
+            else:
+                month, year = int(match.group('num_month')), int(match.group('num_month_year'))
+                if not (1 <= month <= 12 and 1950 <= year <= 2030):
+                    return None
+            temporal_filter.month = month
+            temporal_filter.year = year
+            # Create date range for the entire month
+            temporal_filter.start_date = datetime(year, month, 1)
+            temporal_filter.end_date = _month_end(year, month)
+            return temporal_filter
         
-        if matches:
-            years = [int(year) for year in matches if 1950 <= int(year) <= 2030]
-            if years:
-                year = years[0]  # Take first valid year
-                temporal_filter.year = year
-                temporal_filter.start_date = datetime(year, 1, 1)
-                temporal_filter.end_date = datetime(year, 12, 31)
-                return temporal_filter
-        
-        # Try dateparser for more complex patterns
-        try:
-            import dateparser
-            parsed_date = dateparser.parse(query)
-            if parsed_date and 1950 <= parsed_date.year <= 2030:
-                temporal_filter.start_date = parsed_date
-                temporal_filter.end_date = parsed_date
-                temporal_filter.year = parsed_date.year
-                temporal_filter.month = parsed_date.month
-                return temporal_filter
-        except:
-            pass
+        if kind == 'season':
+            season, year = match.group('season'), int(match.group('season_year'))
+            if not 1950 <= year <= 2030:
+                return None
+            first_month, last_month, year_offset = SEASONS[season]
+            temporal_filter.season = season
+            temporal_filter.year = year
+            temporal_filter.start_date = datetime(year, first_month, 1)
+            temporal_filter.end_date = _month_end(year + year_offset, last_month)
+            return temporal_filter
         
-        return None
+        # Year only pattern
+        return self._year_filter(int(match.group('year')))
+    
+    def _year_filter(self, year: int) -> TemporalFilter:
+        """Date range covering the whole year"""
+        temporal_filter = TemporalFilter()
+        temporal_filter.year = year
+        temporal_filter.start_date = datetime(year, 1, 1)
+        temporal_filter.end_date = datetime(year, 12, 31)
+        return temporal_filter
+    
+    def iter_measurement_matches(self, query: str):
+        """Yield (measurement_type, keyword) for every keyword hit in a lower-cased query"""
+        if self.measurement_automaton is None:
+            for measurement_type, pattern in self.measurement_patterns.items():
+                for match in pattern.finditer(query):
+                    yield measurement_type, match.group(0)
+            return
+        
+        # Single pass over the query; keep the word-boundary rule so that
+        # e.g. 'bar' does not match inside 'barents'
+        for end, owners in self.measurement_automaton.iter(query):
+            start = end - len(owners[0][1]) + 1
+            if _is_word_boundary(query, start) and _is_word_boundary(query, end + 1):
+                yield from owners
     
     def _extract_measurement_types(self, query: str) -> List[MeasurementType]:
-        """Extract measurement types from query"""
-        found_types = []
+        """Extract measurement types from an already lowercased query"""
+        if self.measurement_automaton is None:
+            # One precompiled search per type, stopping at its first hit
+            return [measurement_type for measurement_type, pattern in self.measurement_patterns.items()
+                    if pattern.search(query)]
         
-        for measurement_type, keywords in self.measurement_keywords.items():
-            for keyword in keywords:
-                # Use word boundaries to prevent partial matches (e.g., 'c' in 'ocean')
-                import re
-                pattern = r'\b' + re.escape(keyword) + r'\b'
-                if re.search(pattern, query, re.IGNORECASE):
-                    if measurement_type not in found_types:
-                        found_types.append(measurement_type)
-                    break
-        
-        return found_types
+        hits = {measurement_type for measurement_type, _ in self.iter_measurement_matches(query)}
+        
+        # Report in keyword-table order, independent of where the hits occur
+        return [measurement_type for measurement_type in self.measurement_keywords if measurement_type in hits]
     
     def _extract_statistical_operations(self, query: str) -> List[str]:
         """Extract statistical operations from query"""
-        found_ops = []
+        found_ops = self._find_keywords(self.statistical_automaton, self.statistical_keywords, query)
         
-        for stat_keyword in self.statistical_keywords:
-            if stat_keyword in query:
-                found_ops.append(stat_keyword)
-        
-        return found_ops
+        # Keep the keyword-list order of the per-keyword scan
+        return [stat_keyword for stat_keyword in self.statistical_keywords if stat_keyword in found_ops]
     
     def _extract_keywords_spacy(self, query: str) -> List[str]:
         """Extract keywords using spaCy NLP"""
-        doc = nlp(query)
-        keywords = []
-        
-        for token in doc:
-            if (token.pos_ in ['NOUN', 'ADJ', 'PROPN'] and 
-                not token.is_stop and 
-                not token.is_punct and 
-                len(token.text) > 2):
-                keywords.append(token.lemma_.lower())
-        
-        return list(set(keywords))
+        return self._keywords_from_doc(_get_nlp()(query))
+    
+    def _keywords_from_doc(self, doc) -> List[str]:
+        """Content-word lemmas of an already processed spaCy Doc"""
+        # Cheap flag checks first; dict.fromkeys dedups while keeping query order
+        return list(dict.fromkeys(
+            token.lemma_.lower() for token in doc
+            if not token.is_stop and not token.is_punct and len(token) > 2 and token.pos_ in KEYWORD_POS
+        ))
     
     def _extract_keywords_basic(self, query: str) -> List[str]:
-        """Basic keyword extraction without spaCy"""
+        """Basic keyword extraction without spaCy (query is already lowercased)"""
         # Remove common stop words
-        stop_words = {
-            'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
-            'of', 'with', 'by', 'what', 'was', 'were', 'is', 'are', 'what', 'how'
-        }
-        
-        words = re.findall(r'\b\w+\b', query.lower())
-        keywords = [word for word in words if word not in stop_words and len(word) > 2]
-        
-        return list(set(keywords))
+        words = WORD_RE.findall(query)
+        return list(dict.fromkeys(word for word in words if len(word) > 2 and word not in BASIC_STOP_WORDS))
     
     def _calculate_confidence(self, intent: QueryIntent) -> float:
         """Calculate confidence score for parsed intent"""
@@ -380,6 +517,16 @@ class OceanographicNLP:
         
         return filters
 
+@functools.cache
+def _shared_parser() -> OceanographicNLP:
+    """One parser instance backing the parse cache; all instances share the same tables"""
+    return OceanographicNLP()
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_query_cached(query: str) -> QueryIntent:
+    # Callers build a fresh OceanographicNLP per request, so the cache lives at module level
+    return _shared_parser()._parse_query_uncached(query)
+
 # Example usage and testing
 if __name__ == "__main__":
     nlp_system = OceanographicNLP()
@@ -7,25 +7,112 @@ import sys
 import logging
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 import numpy as np
 from tqdm import tqdm
+import torch
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2.extras import execute_values
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 
+try:
+    from pgvector.psycopg2 import register_vector
+    PGVECTOR_AVAILABLE = True
+except ImportError:
+    PGVECTOR_AVAILABLE = False
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+# Progress is already on the tqdm bar; only every Nth stored batch gets a log line
+LOG_EVERY_BATCHES = 20
+
+# Profiles that have no embedding yet. profile_embeddings.profile_id is VARCHAR, so the
+# cast goes on the argo_profiles side and the probe can use idx_profile_embeddings_profile_id
+PENDING_PROFILES_QUERY = """
+SELECT 
+    ap.profile_id,
+    ap.latitude,
+    ap.longitude,
+    ap.date,
+    ap.institution,
+    ap.platform_number,
+    ap.position_qc,
+    -- Only the depth count is used, so the JSON blob itself never leaves the server
+    CASE
+        WHEN ap.ocean_data IS NULL OR ap.ocean_data = '{}'::jsonb THEN NULL
+        WHEN jsonb_typeof(ap.ocean_data->'depths') = 'array' THEN jsonb_array_length(ap.ocean_data->'depths')
+        ELSE 0
+    END AS n_depths
+FROM argo_profiles ap
+WHERE NOT EXISTS (
+    SELECT 1 FROM profile_embeddings pe WHERE pe.profile_id = ap.profile_id::text
+)
+ORDER BY ap.profile_id
+"""
+
+# Text builders, one per embedding type. Each reads every field once into a local
+def _build_full_metadata_text(profile: Dict[str, Any]) -> str:
+    get = profile.get
+    latitude, longitude = get('latitude'), get('longitude')
+    date, institution, platform = get('date'), get('institution'), get('platform_number')
+    n_depths = get('n_depths')
+    if n_depths is None and get('ocean_data'):
+        n_depths = len(profile['ocean_data'].get('depths', []))
+    parts = []
+    if latitude and longitude:
+        parts.append(f"Location: {latitude:.3f}N, {longitude:.3f}E")
+    if date:
+        parts.append(f"Date: {date}")
+    if institution:
+        parts.append(f"Institution: {institution}")
+    if platform:
+        parts.append(f"Platform: {platform}")
+    if n_depths is not None:
+        parts.append(f"Ocean measurements with {n_depths} data points")
+    return " | ".join(parts)
+
+def _build_location_text(profile: Dict[str, Any]) -> str:
+    get = profile.get
+    latitude, longitude, date = get('latitude'), get('longitude'), get('date')
+    parts = []
+    if latitude and longitude:
+        parts.append(f"{latitude:.3f}N {longitude:.3f}E")
+    if date:
+        parts.append(f"{date}")
+    return " ".join(parts)
+
+def _build_institution_text(profile: Dict[str, Any]) -> str:
+    get = profile.get
+    institution, platform = get('institution'), get('platform_number')
+    parts = []
+    if institution:
+        parts.append(institution)
+    if platform:
+        parts.append(f"Platform {platform}")
+    return " ".join(parts)
+
+def _build_default_text(profile: Dict[str, Any]) -> str:
+    return f"ARGO Profile {profile.get('profile_id', 'Unknown')}"
+
 class EmbeddingGenerator:
     def __init__(self, model_name: str = 'all-MiniLM-L6-v2'):
         self.model_name = model_name
         self.embedding_dim = 384
+        self.encode_batch_size = 64
         self.model = None
+        self._encode_pool = None  # Multi-GPU worker pool, only during generate_embeddings
         self.db_config = self._get_db_config()
+        self._conn = None  # Shared for the whole run instead of one TLS connect per call
+        self._text_builders = {
+            'full_metadata': _build_full_metadata_text,
+            'location': _build_location_text,
+            'institution': _build_institution_text,
+        }
         logger.info(f"Initializing EmbeddingGenerator with model: {model_name}")
         
     def _get_db_config(self) -> Dict[str, str]:
@@ -43,13 +130,17 @@ class EmbeddingGenerator:
             logger.info(f"Loading sentence transformer model: {self.model_name}")
             try:
                 self.model = SentenceTransformer(self.model_name)
+                if torch.cuda.is_available():
+                    # FP16 halves the weights/activations moved per batch and uses tensor cores
+                    self.model = self.model.to('cuda').half()
+                    logger.info("Running model in FP16 on CUDA")
                 logger.info("Model loaded successfully")
             except Exception as e:
                 logger.error(f"Failed to load model: {e}")
                 raise
         return self.model
     
-    def get_db_connection(self) -> Optional[psycopg2.extensions.connection]:
+    def _connect(self) -> Optional[psycopg2.extensions.connection]:
         try:
             conn = psycopg2.connect(**self.db_config)
             return conn
@@ -57,6 +148,27 @@ class EmbeddingGenerator:
             logger.error(f"Database connection failed: {e}")
             return None
     
+    def get_db_connection(self) -> Optional[psycopg2.extensions.connection]:
+        """Return the shared connection, reconnecting if it was closed"""
+        if self._conn is None or self._conn.closed:
+            self._conn = self._connect()
+            if self._conn is not None and PGVECTOR_AVAILABLE:
+                # numpy arrays are then bound as VECTOR values directly
+                register_vector(self._conn)
+        return self._conn
+    
+    def _rollback(self, conn: psycopg2.extensions.connection):
+        """Clear a failed transaction; a broken connection is dropped and reopened on next use"""
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            conn.close()
+    
+    def close(self):
+        if self._conn is not None and not self._conn.closed:
+            self._conn.close()
+        self._conn = None
+    
     def get_profile_count(self) -> int:
         conn = self.get_db_connection()
         if not conn:
@@ -65,12 +177,11 @@ class EmbeddingGenerator:
             cursor = conn.cursor()
             cursor.execute("SELECT COUNT(*) FROM argo_profiles")
             count = cursor.fetchone()[0]
-            conn.close()
+            conn.commit()
             return count
         except Exception as e:
             logger.error(f"Failed to get profile count: {e}")
-            if conn:
-                conn.close()
+            self._rollback(conn)
             return 0
     
     def get_existing_embeddings_count(self) -> int:
@@ -81,53 +192,33 @@ class EmbeddingGenerator:
             cursor = conn.cursor()
             cursor.execute("SELECT COUNT(DISTINCT profile_id) FROM profile_embeddings")
             count = cursor.fetchone()[0]
-            conn.close()
+            conn.commit()
             return count
         except Exception as e:
             logger.error(f"Failed to get existing embeddings count: {e}")
-            if conn:
-                conn.close()
+            self._rollback(conn)
             return 0
     
     def create_profile_text(self, profile: Dict[str, Any], embedding_type: str = 'full_metadata') -> str:
-        if embedding_type == 'full_metadata':
-            parts = []
-            if profile.get('latitude') and profile.get('longitude'):
-                parts.append(f"Location: {profile['latitude']:.3f}N, {profile['longitude']:.3f}E")
-            if profile.get('date'):
-                parts.append(f"Date: {profile['date']}")
-            if profile.get('institution'):
-                parts.append(f"Institution: {profile['institution']}")
-            if profile.get('platform_number'):
-                parts.append(f"Platform: {profile['platform_number']}")
-            if profile.get('ocean_data'):
-                ocean_summary = f"Ocean measurements with {len(profile['ocean_data'].get('depths', []))} data points"
-                parts.append(ocean_summary)
-            return " | ".join(parts)
-        elif embedding_type == 'location':
-            parts = []
-            if profile.get('latitude') and profile.get('longitude'):
-                parts.append(f"{profile['latitude']:.3f}N {profile['longitude']:.3f}E")
-            if profile.get('date'):
-                parts.append(f"{profile['date']}")
-            return " ".join(parts)
-        elif embedding_type == 'institution':
-            parts = []
-            if profile.get('institution'):
-                parts.append(profile['institution'])
-            if profile.get('platform_number'):
-                parts.append(f"Platform {profile['platform_number']}")
-            return " ".join(parts)
-        else:
-            return f"ARGO Profile {profile.get('profile_id', 'Unknown')}"
+        return self._text_builders.get(embedding_type, _build_default_text)(profile)
     
     def generate_embedding(self, text: str) -> np.ndarray:
+        return self.encode_texts([text])[0]
+    
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """Encode many texts in one model call; returns a (len(texts), embedding_dim) float32 array"""
         model = self._load_model()
         try:
-            embedding = model.encode(text, convert_to_numpy=True)
-            return embedding.astype(np.float32)
+            # Unit-length vectors: cosine similarity becomes a plain inner product (vector_ip_ops)
+            if self._encode_pool is not None:
+                embeddings = model.encode_multi_process(texts, self._encode_pool, batch_size=self.encode_batch_size,
+                                                        normalize_embeddings=True)
+            else:
+                embeddings = model.encode(texts, batch_size=self.encode_batch_size, convert_to_numpy=True,
+                                          normalize_embeddings=True, show_progress_bar=False)
+            return embeddings.astype(np.float32, copy=False)
         except Exception as e:
-            logger.error(f"Failed to generate embedding: {e}")
+            logger.error(f"Failed to generate embeddings: {e}")
             raise
     
     def fetch_profiles_batch(self, offset: int, batch_size: int) -> List[Dict[str, Any]]:
@@ -136,25 +227,7 @@ class EmbeddingGenerator:
             return []
         try:
             cursor = conn.cursor()
-            # FIXED: Cast profile_id to VARCHAR for proper JOIN
-            query = """
-            SELECT 
-                ap.profile_id,
-                ap.latitude,
-                ap.longitude,
-                ap.date,
-                ap.institution,
-                ap.platform_number,
-                ap.position_qc,
-                ap.ocean_data
-            FROM argo_profiles ap
-            LEFT JOIN profile_embeddings pe ON CAST(ap.profile_id AS VARCHAR) = pe.profile_id
-            WHERE pe.profile_id IS NULL
-            ORDER BY ap.profile_id
-            LIMIT %s OFFSET %s
-            """
-            
-            cursor.execute(query, (batch_size, offset))
+            cursor.execute(PENDING_PROFILES_QUERY + "LIMIT %s OFFSET %s", (batch_size, offset))
             columns = [desc[0] for desc in cursor.description]
             
             profiles = []
@@ -162,14 +235,43 @@ class EmbeddingGenerator:
                 profile = dict(zip(columns, row))
                 profiles.append(profile)
             
-            conn.close()
+            conn.commit()
             return profiles
         except Exception as e:
             logger.error(f"Failed to fetch profiles batch: {e}")
-            if conn:
-                conn.close()
+            self._rollback(conn)
             return []
     
+    def iter_profile_batches(self, batch_size: int, max_profiles: Optional[int] = None):
+        """Yield batches of profiles without embeddings from one server-side cursor
+        
+        The query runs once and Postgres streams batch_size rows per fetch, instead
+        of re-planning and skipping OFFSET rows for every page. The cursor gets its
+        own connection because commits on the shared one would close it.
+        """
+        conn = self._connect()
+        if not conn:
+            return
+        try:
+            cursor = conn.cursor(name='argo_stream')
+            cursor.itersize = batch_size
+            if max_profiles:
+                cursor.execute(PENDING_PROFILES_QUERY + "LIMIT %s", (max_profiles,))
+            else:
+                cursor.execute(PENDING_PROFILES_QUERY)
+            
+            columns = None
+            while rows := cursor.fetchmany(batch_size):
+                if columns is None:
+                    columns = [desc[0] for desc in cursor.description]
+                yield [dict(zip(columns, row)) for row in rows]
+            
+            cursor.close()
+        except Exception as e:
+            logger.error(f"Failed to stream profiles: {e}")
+        finally:
+            conn.close()
+    
     def store_embeddings_batch(self, embeddings_data: List[Dict[str, Any]]) -> int:
         conn = self.get_db_connection()
         if not conn:
@@ -195,30 +297,39 @@ class EmbeddingGenerator:
                     str(data['profile_id']),  # Convert to string
                     data['embedding_type'],
                     content_text,
-                    data['embedding_vector'].tolist()  # Convert to list
+                    # pgvector adapts the float32 array itself; otherwise send a plain list
+                    data['embedding_vector'] if PGVECTOR_AVAILABLE else data['embedding_vector'].tolist()
                 ))
             
-            execute_batch(cursor, insert_query, values, page_size=100)
+            # One multi-row INSERT per 500 rows instead of one statement per row
+            execute_values(cursor, insert_query, values, page_size=500)
             conn.commit()
             
             stored_count = len(values)
-            conn.close()
-            logger.info(f"Stored {stored_count} embeddings successfully")
+            logger.debug(f"Stored {stored_count} embeddings successfully")
             return stored_count
             
         except Exception as e:
             logger.error(f"Failed to store embeddings batch: {e}")
-            if conn:
-                conn.rollback()
-                conn.close()
+            self._rollback(conn)
             return 0
     
+    def _store_batch(self, embeddings_data: List[Dict[str, Any]], profile_count: int, batch_number: int) -> int:
+        stored_count = self.store_embeddings_batch(embeddings_data)
+        if batch_number % LOG_EVERY_BATCHES == 0:
+            logger.info(f"Batch {batch_number} complete: {profile_count} profiles, {stored_count} embeddings stored")
+        return stored_count
+    
     def generate_embeddings(self, batch_size: int = 100, max_profiles: Optional[int] = None, embedding_types: List[str] = ['full_metadata']) -> int:
         logger.info("Starting embedding generation process...")
         logger.info(f"Model: {self.model_name} (Dimensions: {self.embedding_dim})")
         logger.info(f"Embedding types: {embedding_types}")
         
-        self._load_model()
+        model = self._load_model()
+        if torch.cuda.device_count() > 1:
+            # One worker process per GPU; each batch is split across all of them
+            self._encode_pool = model.start_multi_process_pool()
+            logger.info(f"Encoding on {torch.cuda.device_count()} GPUs")
         
         total_profiles = self.get_profile_count()
         existing_embeddings = self.get_existing_embeddings_count()
@@ -232,65 +343,91 @@ class EmbeddingGenerator:
         
         total_embeddings_generated = 0
         total_profiles_processed = 0
-        offset = 0
+        batch_number = 0
         
         pbar = tqdm(total=total_profiles, desc="Generating embeddings")
         
+        # Three-stage pipeline: one thread prefetches the next batch and another stores the
+        # previous one while this thread encodes, so the model is not idle during DB I/O
+        batches = self.iter_profile_batches(batch_size, max_profiles)
+        text_builders = [(t, self._text_builders.get(t, _build_default_text)) for t in embedding_types]
+        reader = ThreadPoolExecutor(max_workers=1)
+        writer = ThreadPoolExecutor(max_workers=1)
+        pending_store = None
+        
         try:
-            while total_profiles_processed < total_profiles:
-                profiles_batch = self.fetch_profiles_batch(offset, batch_size)
+            next_batch = reader.submit(next, batches, None)
+            while (profiles_batch := next_batch.result()) is not None:
+                next_batch = reader.submit(next, batches, None)
                 
-                if not profiles_batch:
-                    logger.info("No more profiles to process")
-                    break
-                
-                embeddings_data = []
+                # Collect every text of the batch first so the model encodes them in one call
+                texts = []
+                meta = []
+                batch_profiles = 0
                 
                 for profile in profiles_batch:
-                    if max_profiles and total_profiles_processed >= max_profiles:
+                    if max_profiles and total_profiles_processed + batch_profiles >= max_profiles:
                         break
                     
-                    for embedding_type in embedding_types:
+                    for embedding_type, build_text in text_builders:
                         try:
-                            text = self.create_profile_text(profile, embedding_type)
-                            
-                            if not text.strip():
-                                logger.warning(f"Empty text for profile {profile.get('profile_id')}")
-                                continue
-                            
-                            embedding = self.generate_embedding(text)
-                            
-                            embedding_data = {
-                                'profile_id': profile['profile_id'],
-                                'embedding_type': embedding_type,
-                                'embedding_vector': embedding,
-                                'source_text': text
-                            }
-                            
-                            embeddings_data.append(embedding_data)
-                            
+                            text = build_text(profile)
                         except Exception as e:
-                            logger.error(f"Failed to generate embedding for profile {profile.get('profile_id')}: {e}")
+                            logger.error(f"Failed to build text for profile {profile.get('profile_id')}: {e}")
+                            continue
+                        
+                        if not text.strip():
+                            logger.warning(f"Empty text for profile {profile.get('profile_id')}")
                             continue
+                        
+                        texts.append(text)
+                        meta.append((profile['profile_id'], embedding_type))
                     
-                    total_profiles_processed += 1
-                    pbar.update(1)
+                    batch_profiles += 1
                 
-                if embeddings_data:
-                    stored_count = self.store_embeddings_batch(embeddings_data)
-                    total_embeddings_generated += stored_count
+                total_profiles_processed += batch_profiles
+                pbar.update(batch_profiles)
+                batch_number += 1
+                
+                embeddings_data = []
+                
+                if texts:
+                    try:
+                        vectors = self.encode_texts(texts)
+                    except Exception as e:
+                        logger.error(f"Failed to generate embeddings for batch: {e}")
+                        vectors = []
                     
-                    logger.info(f"Batch complete: {len(profiles_batch)} profiles, {stored_count} embeddings stored")
+                    for (profile_id, embedding_type), text, embedding in zip(meta, texts, vectors):
+                        embeddings_data.append({
+                            'profile_id': profile_id,
+                            'embedding_type': embedding_type,
+                            'embedding_vector': embedding,
+                            'source_text': text
+                        })
                 
-                offset += batch_size
-                time.sleep(0.1)
+                if embeddings_data:
+                    # At most one store in flight; writes stay in batch order
+                    if pending_store is not None:
+                        total_embeddings_generated += pending_store.result()
+                    pending_store = writer.submit(self._store_batch, embeddings_data, batch_profiles, batch_number)
         
         except KeyboardInterrupt:
             logger.info("Embedding generation interrupted by user")
         except Exception as e:
             logger.error(f"Embedding generation failed: {e}")
         finally:
+            # Let an in-flight store finish so encoded work is not lost
+            writer.shutdown(wait=True)
+            if pending_store is not None and pending_store.exception() is None:
+                total_embeddings_generated += pending_store.result()
+            reader.shutdown(wait=True)
+            batches.close()
             pbar.close()
+            self.close()
+            if self._encode_pool is not None:
+                model.stop_multi_process_pool(self._encode_pool)
+                self._encode_pool = None
         
         logger.info(f"Embedding generation complete!")
         logger.info(f"Total profiles processed: {total_profiles_processed:,}")
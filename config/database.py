@@ -3,6 +3,7 @@ Database configuration module for Agentic RAG system.
 Loads database connection settings from environment variables.
 """
 import os
+from functools import cached_property
 from typing import Optional
 from urllib.parse import quote_plus
 
@@ -29,9 +30,9 @@ class DatabaseConfig:
         # Full database URL (takes precedence if provided)
         self._database_url = os.getenv('DATABASE_URL')
     
-    @property
+    @cached_property
     def database_url(self) -> str:
-        """Get the complete database connection URL."""
+        """Get the complete database connection URL (built once; settings are read at init)."""
         if self._database_url:
             return self._database_url
         
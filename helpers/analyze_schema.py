@@ -7,167 +7,246 @@ project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 from config.database import get_database_url, db_config
-from sqlalchemy import create_engine, text
-import pandas as pd
+import functools
+import json
 import logging
+import os
+import time
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def analyze_profiles_schema():
+# Analysis results are reused for an hour; --refresh bypasses the cache
+ANALYSIS_CACHE_TTL_SECONDS = 3600
+ANALYSIS_CACHE_FILE = project_root / ".cache" / "schema_analysis.json"
+REDIS_URL = os.getenv("REDIS_URL")
+
+def _cache_key(kind: str) -> str:
+    return f"schema_analysis:{db_config.host}:{db_config.port}:{db_config.name}:{kind}"
+
+@functools.cache
+def _redis_client():
+    return redis.Redis.from_url(REDIS_URL) if REDIS_AVAILABLE and REDIS_URL else None
+
+def _cache_get(kind: str):
+    """Return a cached analysis result, or None on a miss. Redis when configured, else a local file."""
+    key = _cache_key(kind)
+    try:
+        client = _redis_client()
+        if client is not None:
+            cached = client.get(key)
+            return json.loads(cached) if cached else None
+        entry = json.loads(ANALYSIS_CACHE_FILE.read_text()).get(key)
+        if entry and time.time() - entry["stored_at"] < ANALYSIS_CACHE_TTL_SECONDS:
+            return entry["value"]
+    except (OSError, ValueError, KeyError) as e:
+        logger.debug(f"Analysis cache read skipped: {e}")
+    except Exception as e:
+        logger.warning(f"Analysis cache unavailable: {e}")
+    return None
+
+def _cache_set(kind: str, value) -> None:
+    key = _cache_key(kind)
+    try:
+        client = _redis_client()
+        if client is not None:
+            client.setex(key, ANALYSIS_CACHE_TTL_SECONDS, json.dumps(value))
+            return
+        try:
+            entries = json.loads(ANALYSIS_CACHE_FILE.read_text())
+        except (OSError, ValueError):
+            entries = {}
+        entries[key] = {"stored_at": time.time(), "value": value}
+        ANALYSIS_CACHE_FILE.parent.mkdir(exist_ok=True)
+        ANALYSIS_CACHE_FILE.write_text(json.dumps(entries))
+    except Exception as e:
+        logger.warning(f"Analysis cache write skipped: {e}")
+
+def _fetch_profiles_schema():
+    """Columns, row count, stats and indexes of the profiles table as JSON-friendly lists"""
+    from sqlalchemy import create_engine, text
+    
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    
+    with engine.connect() as conn:
+        # Columns, row count, stats and indexes in one round trip; each part comes back as JSON
+        # Columns are read from pg_attribute directly; format_type() already includes the length
+        result = conn.execute(text("""
+            SELECT
+                (SELECT json_agg(json_build_array(
+                            a.attname, format_type(a.atttypid, a.atttypmod), NULL,
+                            CASE WHEN a.attnotnull THEN 'NO' ELSE 'YES' END,
+                            pg_get_expr(d.adbin, d.adrelid), a.attnum
+                        ) ORDER BY a.attnum)
+                   FROM pg_attribute a
+                   LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+                  WHERE a.attrelid = to_regclass('profiles')
+                    AND a.attnum > 0 AND NOT a.attisdropped) AS columns,
+                (SELECT COUNT(*) FROM profiles) AS total_rows,
+                (SELECT json_build_array(
+                            COUNT(DISTINCT float_id), COUNT(DISTINCT platform_number),
+                            MIN(latitude), MAX(latitude), MIN(longitude), MAX(longitude),
+                            MIN(created_at), MAX(created_at))
+                   FROM profiles
+                  WHERE latitude IS NOT NULL AND longitude IS NOT NULL) AS stats,
+                (SELECT json_agg(json_build_array(schemaname, tablename, indexname, indexdef)
+                                 ORDER BY indexname)
+                   FROM pg_indexes
+                  WHERE tablename = 'profiles') AS indexes;
+        """))
+        
+        return list(result.fetchone())
+
+def analyze_profiles_schema(refresh: bool = False):
     """Analyze the current profiles table schema"""
     try:
-        pg_url = get_database_url()
         logger.info(f"Analyzing schema on: {db_config.host}:{db_config.port}/{db_config.name}")
         
-        engine = create_engine(pg_url, pool_pre_ping=True)
+        snapshot = None if refresh else _cache_get("schema")
+        if snapshot is None:
+            snapshot = _fetch_profiles_schema()
+            _cache_set("schema", snapshot)
+        else:
+            logger.info("(cached result; pass --refresh to re-query)")
         
-        with engine.connect() as conn:
-            # Get table info
-            result = conn.execute(text("""
-                SELECT 
-                    column_name,
-                    data_type,
-                    character_maximum_length,
-                    is_nullable,
-                    column_default,
-                    ordinal_position
-                FROM information_schema.columns 
-                WHERE table_name = 'profiles'
-                ORDER BY ordinal_position;
-            """))
-            
-            schema_info = result.fetchall()
-            
-            if not schema_info:
-                logger.warning(" Profiles table not found")
-                return False
-            
-            logger.info(f"\n PROFILES TABLE SCHEMA ANALYSIS")
-            logger.info("=" * 60)
-            
-            for i, (col_name, data_type, max_length, nullable, default, position) in enumerate(schema_info, 1):
-                length_info = f"({max_length})" if max_length else ""
-                null_info = "NULL" if nullable == "YES" else "NOT NULL"
-                default_info = f" DEFAULT {default}" if default else ""
-                
-                logger.info(f"{i:2}. {col_name:25} {data_type}{length_info:10} {null_info:8}{default_info}")
-            
-            # Get row count and basic stats
-            result = conn.execute(text("SELECT COUNT(*) FROM profiles;"))
-            total_rows = result.fetchone()[0]
-            
-            logger.info(f"\n TABLE STATISTICS")
-            logger.info("-" * 30)
-            logger.info(f"Total rows: {total_rows:,}")
-            
-            # Sample some data characteristics
-            if total_rows > 0:
-                sample_query = text("""
-                    SELECT 
-                        COUNT(DISTINCT float_id) as unique_floats,
-                        COUNT(DISTINCT platform_number) as unique_platforms,
-                        MIN(latitude) as min_lat,
-                        MAX(latitude) as max_lat,
-                        MIN(longitude) as min_lon,
-                        MAX(longitude) as max_lon,
-                        MIN(created_at) as earliest_record,
-                        MAX(created_at) as latest_record
-                    FROM profiles 
-                    WHERE latitude IS NOT NULL AND longitude IS NOT NULL;
-                """)
-                
-                result = conn.execute(sample_query)
-                stats = result.fetchone()
-                
-                if stats:
-                    unique_floats, unique_platforms, min_lat, max_lat, min_lon, max_lon, earliest, latest = stats
-                    
-                    logger.info(f"Unique floats: {unique_floats:,}")
-                    logger.info(f"Unique platforms: {unique_platforms:,}")
-                    logger.info(f"Latitude range: {min_lat:.2f} to {max_lat:.2f}")
-                    logger.info(f"Longitude range: {min_lon:.2f} to {max_lon:.2f}")
-                    logger.info(f"Date range: {earliest} to {latest}")
-            
-            # Check indexes
-            result = conn.execute(text("""
-                SELECT 
-                    schemaname,
-                    tablename,
-                    indexname,
-                    indexdef
-                FROM pg_indexes 
-                WHERE tablename = 'profiles'
-                ORDER BY indexname;
-            """))
-            
-            indexes = result.fetchall()
-            
-            logger.info(f"\n INDEXES ({len(indexes)} total)")
-            logger.info("-" * 40)
+        # A missing profiles table fails the query itself ("relation does not exist")
+        schema_info, total_rows, stats, indexes = snapshot
+        indexes = indexes or []
+        
+        logger.info(f"\n PROFILES TABLE SCHEMA ANALYSIS")
+        logger.info("=" * 60)
+        
+        for i, (col_name, data_type, max_length, nullable, default, position) in enumerate(schema_info, 1):
+            length_info = f"({max_length})" if max_length else ""
+            null_info = "NULL" if nullable == "YES" else "NOT NULL"
+            default_info = f" DEFAULT {default}" if default else ""
             
-            for schema, table, idx_name, idx_def in indexes:
-                # Extract key parts of index definition
-                if "USING btree" in idx_def:
-                    idx_type = "BTREE"
-                elif "USING gist" in idx_def:
-                    idx_type = "GIST"
-                elif "USING gin" in idx_def:
-                    idx_type = "GIN"
-                else:
-                    idx_type = "OTHER"
-                
-                logger.info(f" {idx_name:30} ({idx_type})")
+            logger.info(f"{i:2}. {col_name:25} {data_type}{length_info:10} {null_info:8}{default_info}")
+        
+        logger.info(f"\n TABLE STATISTICS")
+        logger.info("-" * 30)
+        logger.info(f"Total rows: {total_rows:,}")
+        
+        # Sample some data characteristics
+        if total_rows > 0 and stats:
+            unique_floats, unique_platforms, min_lat, max_lat, min_lon, max_lon, earliest, latest = stats
             
-            logger.info(f"\n Schema analysis complete!")
-            return True
+            logger.info(f"Unique floats: {unique_floats:,}")
+            logger.info(f"Unique platforms: {unique_platforms:,}")
+            logger.info(f"Latitude range: {min_lat:.2f} to {max_lat:.2f}")
+            logger.info(f"Longitude range: {min_lon:.2f} to {max_lon:.2f}")
+            logger.info(f"Date range: {earliest} to {latest}")
+        
+        logger.info(f"\n INDEXES ({len(indexes)} total)")
+        logger.info("-" * 40)
+        
+        for schema, table, idx_name, idx_def in indexes:
+            # Extract key parts of index definition
+            if "USING btree" in idx_def:
+                idx_type = "BTREE"
+            elif "USING gist" in idx_def:
+                idx_type = "GIST"
+            elif "USING gin" in idx_def:
+                idx_type = "GIN"
+            else:
+                idx_type = "OTHER"
             
+            logger.info(f" {idx_name:30} ({idx_type})")
+        
+        logger.info(f"\n Schema analysis complete!")
+        return True
+        
     except Exception as e:
         logger.error(f" Schema analysis failed: {e}")
         return False
 
-def analyze_data_quality():
-    """Analyze data quality in the profiles table"""
+QUALITY_COLUMNS = ('latitude', 'longitude', 'profile_time', 'float_id',
+                   'platform_number', 'file_path', 'parquet_path')
+
+def _fetch_data_quality(exact: bool):
+    """Total rows plus non-NULL counts for QUALITY_COLUMNS, estimated unless exact is set"""
+    from sqlalchemy import create_engine, text
+    
+    engine = create_engine(get_database_url(), pool_pre_ping=True)
+    
+    with engine.connect() as conn:
+        if not exact:
+            result = conn.execute(text("""
+                SELECT c.reltuples::bigint, s.attname, s.null_frac
+                FROM pg_class c
+                JOIN pg_stats s ON s.schemaname = c.relnamespace::regnamespace::text
+                               AND s.tablename = c.relname
+                WHERE c.oid = to_regclass('profiles')
+                  AND s.attname = ANY(:columns);
+            """), {"columns": list(QUALITY_COLUMNS)})
+            rows = result.fetchall()
+            
+            # reltuples is -1 (or 0) and pg_stats empty until the table has been analyzed. A column
+            # without a pg_stats row (missing, never analyzed, not readable by this role) has no
+            # estimate at all, so anything short of full coverage uses the exact counts instead
+            null_frac = {attname: frac for _, attname, frac in rows}
+            if rows and rows[0][0] > 0 and len(null_frac) == len(QUALITY_COLUMNS):
+                total = rows[0][0]
+                logger.info("(estimated from planner statistics; pass --exact for exact counts)")
+                return [total] + [round(total * (1 - null_frac[col])) for col in QUALITY_COLUMNS]
+        
+        # Check for NULL values in key columns
+        quality_query = text("""
+            SELECT 
+                COUNT(*) as total_rows,
+                COUNT(latitude) as has_latitude,
+                COUNT(longitude) as has_longitude,
+                COUNT(profile_time) as has_profile_time,
+                COUNT(float_id) as has_float_id,
+                COUNT(platform_number) as has_platform_number,
+                COUNT(file_path) as has_file_path,
+                COUNT(parquet_path) as has_parquet_path
+            FROM profiles;
+        """)
+        
+        result = conn.execute(quality_query)
+        return list(result.fetchone())
+
+def analyze_data_quality(exact: bool = False, refresh: bool = False):
+    """Analyze data quality in the profiles table
+    
+    By default the non-NULL counts are estimated from pg_stats.null_frac and pg_class.reltuples,
+    which costs nothing but is only as fresh as the last ANALYZE. exact=True (or a table with no
+    statistics yet) falls back to a full-scan COUNT per column.
+    """
     try:
-        pg_url = get_database_url()
-        engine = create_engine(pg_url, pool_pre_ping=True)
+        logger.info(f"\n DATA QUALITY ANALYSIS")
+        logger.info("=" * 40)
         
-        with engine.connect() as conn:
-            logger.info(f"\n DATA QUALITY ANALYSIS")
-            logger.info("=" * 40)
-            
-            # Check for NULL values in key columns
-            quality_query = text("""
-                SELECT 
-                    COUNT(*) as total_rows,
-                    COUNT(latitude) as has_latitude,
-                    COUNT(longitude) as has_longitude,
-                    COUNT(profile_time) as has_profile_time,
-                    COUNT(float_id) as has_float_id,
-                    COUNT(platform_number) as has_platform_number,
-                    COUNT(file_path) as has_file_path,
-                    COUNT(parquet_path) as has_parquet_path
-                FROM profiles;
-            """)
-            
-            result = conn.execute(quality_query)
-            quality_stats = result.fetchone()
-            
-            if quality_stats:
-                total, lat, lon, time, float_id, platform, file_path, parquet = quality_stats
-                
-                logger.info(f"Total records: {total:,}")
-                logger.info(f"Has latitude: {lat:,} ({lat/total*100:.1f}%)")
-                logger.info(f"Has longitude: {lon:,} ({lon/total*100:.1f}%)")
-                logger.info(f"Has profile_time: {time:,} ({time/total*100:.1f}%)")
-                logger.info(f"Has float_id: {float_id:,} ({float_id/total*100:.1f}%)")
-                logger.info(f"Has platform_number: {platform:,} ({platform/total*100:.1f}%)")
-                logger.info(f"Has file_path: {file_path:,} ({file_path/total*100:.1f}%)")
-                logger.info(f"Has parquet_path: {parquet:,} ({parquet/total*100:.1f}%)")
-            
-            return True
+        cache_kind = "quality_exact" if exact else "quality"
+        quality_stats = None if refresh else _cache_get(cache_kind)
+        if quality_stats is None:
+            quality_stats = _fetch_data_quality(exact)
+            _cache_set(cache_kind, quality_stats)
+        else:
+            logger.info("(cached result; pass --refresh to re-query)")
+        
+        if quality_stats and quality_stats[0]:
+            total, lat, lon, time, float_id, platform, file_path, parquet = quality_stats
             
+            logger.info(f"Total records: {total:,}")
+            logger.info(f"Has latitude: {lat:,} ({lat/total*100:.1f}%)")
+            logger.info(f"Has longitude: {lon:,} ({lon/total*100:.1f}%)")
+            logger.info(f"Has profile_time: {time:,} ({time/total*100:.1f}%)")
+            logger.info(f"Has float_id: {float_id:,} ({float_id/total*100:.1f}%)")
+            logger.info(f"Has platform_number: {platform:,} ({platform/total*100:.1f}%)")
+            logger.info(f"Has file_path: {file_path:,} ({file_path/total*100:.1f}%)")
+            logger.info(f"Has parquet_path: {parquet:,} ({parquet/total*100:.1f}%)")
+        
+        return True
+        
     except Exception as e:
         logger.error(f" Data quality analysis failed: {e}")
         return False
@@ -184,8 +263,9 @@ if __name__ == "__main__":
     logger.info(f" Target database: {db_config.host}:{db_config.port}/{db_config.name}")
     
     success = True
-    success &= analyze_profiles_schema()
-    success &= analyze_data_quality()
+    refresh = "--refresh" in sys.argv
+    success &= analyze_profiles_schema(refresh=refresh)
+    success &= analyze_data_quality(exact="--exact" in sys.argv, refresh=refresh)
     
     if success:
         logger.info("\n Analysis complete!")
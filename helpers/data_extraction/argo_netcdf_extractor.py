@@ -4,40 +4,265 @@ ARGO NetCDF to Database Extractor
 Efficiently extracts real ARGO oceanographic data from NetCDF files
 """
 import os
-import glob
+import sys
 import logging
-import json
+import csv
+import io
 import time
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+from collections import deque
+from pathlib import Path
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional
 import numpy as np
-from netCDF4 import Dataset
-import psycopg2
-from psycopg2.extras import execute_values
-from dotenv import load_dotenv
-from tqdm import tqdm
+import orjson
+
+# Add config to path; config.database loads .env once for the process
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from config.database import db_config
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
-load_dotenv()
+
+# Files handed to each worker per IPC round trip
+EXTRACT_CHUNKSIZE = 64
+
+# Profiles per COPY round trip
+INSERT_BATCH_SIZE = 2000
+
+# HDF5 chunk cache per open NetCDF file in the extraction workers
+NC_CHUNK_CACHE_BYTES = 64 * 1024
+
+# Session settings for bulk-load connections: commits skip the WAL flush wait, index builds
+# get enough memory to sort in RAM, and JIT is off since it only adds compile time to inserts
+BULK_LOAD_SESSION_OPTIONS = '-c synchronous_commit=off -c work_mem=256MB -c maintenance_work_mem=1GB -c jit=off'
+
+# An unquoted empty CSV field means NULL; the text columns keep '' like the old INSERT did
+COPY_PROFILES_SQL = """
+COPY argo_profiles (
+    latitude, longitude, date, institution, platform_number,
+    position_qc, ocean_data, file_path, wmo_inst_type, project_name, data_centre,
+    parquet_path, parquet_profile_idx, ocean_blob
+) FROM STDIN WITH (
+    FORMAT csv,
+    FORCE_NOT_NULL (institution, platform_number, wmo_inst_type, project_name, data_centre)
+)
+"""
+
+# NetCDF character variables copied onto the profile dict
+CHAR_FIELDS = (
+    ('PLATFORM_NUMBER', 'platform_number'),
+    ('DATA_CENTRE', 'data_centre'),
+    ('WMO_INST_TYPE', 'wmo_inst_type'),
+    ('PROJECT_NAME', 'project_name'),
+)
+
+# Measured variables copied into ocean_data
+OCEAN_FIELDS = (
+    ('PRES', 'pressure'),
+    ('TEMP', 'temperature'),
+    ('PSAL', 'salinity'),
+)
+
+def iter_nc_files(root: str, sample_rate: int = 1, max_files: Optional[int] = None) -> Iterator[str]:
+    """Yield every sample_rate-th .nc file under root, stopping after max_files"""
+    pending = deque([root])
+    seen = 0
+    yielded = 0
+    while pending:
+        try:
+            entries = os.scandir(pending.popleft())
+        except OSError as e:
+            logger.debug(f"Cannot scan directory: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                # Hidden entries are skipped, as glob does
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    pending.append(entry.path)
+                elif entry.name.endswith('.nc') and entry.is_file():
+                    if seen % sample_rate == 0:
+                        yield entry.path
+                        yielded += 1
+                        if max_files and yielded >= max_files:
+                            return
+                    seen += 1
+
+def pack_ocean_data(ocean_data: Dict[str, np.ndarray]) -> bytes:
+    """Pack ocean_data into one blosc/zstd-compressed float32 block.
+    
+    The first byte flags which OCEAN_FIELDS are present (bit i = OCEAN_FIELDS[i]); the rest is
+    the present fields stacked as a (fields, levels) float32 array, NaN-padded to equal length.
+    """
+    import blosc
+    
+    present = 0
+    arrays = []
+    for i, (_, key) in enumerate(OCEAN_FIELDS):
+        values = ocean_data.get(key)
+        if values is not None:
+            present |= 1 << i
+            arrays.append(np.asarray(values, dtype=np.float32))
+    levels = max((len(values) for values in arrays), default=0)
+    block = np.full((len(arrays), levels), np.nan, dtype=np.float32)
+    for row, values in enumerate(arrays):
+        block[row, :len(values)] = values
+    return bytes((present,)) + blosc.compress(block.tobytes(), typesize=4, cname='zstd', clevel=3)
+
+def unpack_ocean_blob(blob: bytes) -> Dict[str, np.ndarray]:
+    """Inverse of pack_ocean_data: ocean_blob column value back to {key: float32 array}"""
+    import blosc
+    
+    blob = bytes(blob)  # psycopg2 returns bytea as memoryview
+    keys = [key for i, (_, key) in enumerate(OCEAN_FIELDS) if blob[0] & (1 << i)]
+    if not keys:
+        return {}
+    block = np.frombuffer(blosc.decompress(blob[1:]), dtype=np.float32).reshape(len(keys), -1)
+    return dict(zip(keys, block))
+
+def decode_char_array(values) -> str:
+    """First profile's value from a NetCDF S1 char array, stripped; invalid UTF-8 bytes are dropped.
+    
+    A 1-D array holds one char per profile (e.g. POSITION_QC(N_PROF)); higher ranks end in the
+    string dimension (e.g. PLATFORM_NUMBER(N_PROF, STRING8)) and are joined by chartostring.
+    """
+    from netCDF4 import chartostring
+    
+    if values.ndim <= 1:
+        raw = np.ma.getdata(values).ravel()[:1].tobytes()
+    else:
+        raw = np.ravel(chartostring(values, encoding='bytes'))[0]
+    return raw.decode('utf-8', errors='ignore').replace('\x00', '').strip()
+
+def _decode_char_var(variables, name: str) -> Optional[str]:
+    """Decode a NetCDF char variable to a stripped string, or None if it is absent"""
+    var = variables.get(name)
+    if var is None:
+        return None
+    values = var[:]
+    if getattr(values, 'dtype', None) == 'S1':
+        return decode_char_array(values)
+    return str(values[0]).strip()
+
+def _init_extract_worker():
+    """Shrink the HDF5 chunk cache: each file is opened once for a handful of small variables,
+    so the default 1MB per-open cache is never reused"""
+    import netCDF4
+    netCDF4.set_chunk_cache(size=NC_CHUNK_CACHE_BYTES, nelems=1, preemption=0.0)
+
+def extract_profile_from_nc(nc_file_path: str) -> Optional[Dict[str, Any]]:
+    """Extract ARGO profile data from NetCDF file (module level so worker processes can pickle it)"""
+    from netCDF4 import Dataset
+    
+    try:
+        with Dataset(nc_file_path, 'r') as nc:
+            # Extract basic profile information
+            profile = {}
+            # Look the variable dict up once; every read below goes through it
+            variables = nc.variables
+            
+            # Geographic coordinates (upper-case ARGO names, lower-case fallback)
+            for var_name, key in (('LATITUDE', 'latitude'), ('LONGITUDE', 'longitude')):
+                var = variables.get(var_name)
+                if var is None:
+                    var = variables.get(key)
+                if var is not None:
+                    # One element is enough; invalid files are rejected before anything else is read
+                    profile[key] = float(var[0:1][0]) if var.size > 0 else None
+            
+            # Basic validation, before any of the other variables are read
+            if (profile.get('latitude') is None or 
+                profile.get('longitude') is None or
+                abs(profile.get('latitude', 999)) > 90 or
+                abs(profile.get('longitude', 999)) > 180):
+                return None
+            
+            # Date/Time
+            juld_var = variables.get('JULD')
+            if juld_var is not None:
+                juld = juld_var[:]
+                if len(juld) > 0 and not np.ma.is_masked(juld[0]):
+                    # JULD is days since 1950-01-01
+                    ref_date = datetime(1950, 1, 1)
+                    try:
+                        profile_date = ref_date + timedelta(days=float(juld[0]))
+                        profile['date'] = profile_date.date()
+                    except:
+                        profile['date'] = datetime.now().date()
+                else:
+                    profile['date'] = datetime.now().date()
+            else:
+                profile['date'] = datetime.now().date()
+            
+            # Platform and institution info
+            for var_name, key in CHAR_FIELDS:
+                value = _decode_char_var(variables, var_name)
+                if value is not None:
+                    profile[key] = value
+            
+            # Ocean data (temperature, salinity, pressure), kept as float32 arrays: ARGO precision
+            # doesn't need 8 bytes and orjson serializes them without building Python lists
+            ocean_data = {}
+            
+            for var_name, key in OCEAN_FIELDS:
+                var = variables.get(var_name)
+                if var is not None:
+                    values = var[:]
+                    # A variable with any fill value is dropped so the kept arrays stay level-aligned;
+                    # with no mask at all the data is used as-is without scanning or compressing
+                    mask = np.ma.getmask(values)
+                    if mask is np.ma.nomask or not mask.any():
+                        ocean_data[key] = np.ravel(np.ma.getdata(values)).astype(np.float32)
+            
+            profile['ocean_data'] = ocean_data
+            profile['file_path'] = nc_file_path
+            
+            return profile
+            
+    except Exception as e:
+        logger.debug(f"Failed to extract from {nc_file_path}: {e}")
+        return None
 
 class ARGONetCDFExtractor:
-    def __init__(self):
-        self.db_config = {
-            'host': os.getenv('DB_HOST'),
-            'port': os.getenv('DB_PORT'),
-            'database': os.getenv('DB_NAME'),
-            'user': os.getenv('DB_USER'),
-            'password': os.getenv('DB_PASSWORD'),
-            'sslmode': os.getenv('DB_SSL_MODE', 'require')
-        }
+    def __init__(self, parquet_dir: Optional[str] = None, pack_ocean: bool = False):
+        """
+        Args:
+            parquet_dir: When set, each batch's PRES/TEMP/PSAL arrays are written to a zstd Parquet
+                file here and rows only reference it (parquet_path, parquet_profile_idx); ocean_data
+                is then left empty. None keeps the arrays in the ocean_data JSONB column.
+            pack_ocean: Store the arrays as a blosc/zstd float32 blob in the ocean_blob BYTEA column
+                (read back with unpack_ocean_blob) instead of JSONB; ocean_data is then left empty.
+                Needs the blosc package.
+        """
+        if parquet_dir and pack_ocean:
+            raise ValueError("parquet_dir and pack_ocean are alternative ocean_data stores; pick one")
+        # The extractor talks to a remote database, so TLS stays required unless DB_SSL_MODE says otherwise
+        self.db_config = {**db_config.connection_params, 'sslmode': os.getenv('DB_SSL_MODE', 'require')}
         self.stats = {'processed': 0, 'errors': 0, 'skipped': 0, 'inserted': 0}
+        self._conn = None  # Reused for every batch instead of one TLS handshake per insert
+        self.parquet_dir = Path(parquet_dir) if parquet_dir else None
+        self._parquet_batches = 0
+        self.pack_ocean = pack_ocean
         
     def get_connection(self):
-        return psycopg2.connect(**self.db_config)
+        """Return the shared connection, reconnecting if it was closed"""
+        import psycopg2
+        
+        if self._conn is None or self._conn.closed:
+            # Batch commits don't wait for the WAL flush; a crash can lose the last few batches
+            # of a re-runnable load but never corrupts the table
+            self._conn = psycopg2.connect(**self.db_config, options=BULK_LOAD_SESSION_OPTIONS)
+        return self._conn
+    
+    def close(self):
+        if self._conn is not None and not self._conn.closed:
+            self._conn.close()
+        self._conn = None
     
     def create_table(self):
-        """Create the argo_profiles table with proper schema"""
+        """Create the argo_profiles table with proper schema (indexes come from create_indexes)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -59,119 +284,65 @@ class ARGONetCDFExtractor:
             wmo_inst_type VARCHAR(50),
             project_name VARCHAR(100),
             data_centre VARCHAR(50),
+            parquet_path TEXT,
+            parquet_profile_idx INTEGER,
+            ocean_blob BYTEA,
             created_at TIMESTAMP DEFAULT NOW()
         );
-        
-        CREATE INDEX idx_argo_lat_lon ON argo_profiles(latitude, longitude);
-        CREATE INDEX idx_argo_date ON argo_profiles(date);
-        CREATE INDEX idx_argo_platform ON argo_profiles(platform_number);
         """)
         
         conn.commit()
-        conn.close()
+        cursor.close()
         logger.info(" Created fresh argo_profiles table")
     
+    def create_indexes(self):
+        """Index argo_profiles once the bulk load is done, instead of maintaining indexes per row"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_argo_lat_lon ON argo_profiles(latitude, longitude);
+        -- Files are walked year/month directory by directory, so date follows insert order
+        -- and a BRIN index answers range scans at a fraction of a BTREE's size
+        CREATE INDEX IF NOT EXISTS idx_argo_date_brin ON argo_profiles USING BRIN(date) WITH (pages_per_range = 32);
+        CREATE INDEX IF NOT EXISTS idx_argo_platform ON argo_profiles(platform_number);
+        ANALYZE argo_profiles;
+        """)
+        
+        conn.commit()
+        cursor.close()
+        logger.info(" Created argo_profiles indexes")
+    
     def extract_profile_from_nc(self, nc_file_path: str) -> Optional[Dict[str, Any]]:
         """Extract ARGO profile data from NetCDF file"""
-        try:
-            with Dataset(nc_file_path, 'r') as nc:
-                # Extract basic profile information
-                profile = {}
-                
-                # Geographic coordinates
-                if 'LATITUDE' in nc.variables:
-                    lat = nc.variables['LATITUDE'][:]
-                    profile['latitude'] = float(lat[0]) if len(lat) > 0 else None
-                elif 'latitude' in nc.variables:
-                    profile['latitude'] = float(nc.variables['latitude'][:][0])
-                
-                if 'LONGITUDE' in nc.variables:
-                    lon = nc.variables['LONGITUDE'][:]
-                    profile['longitude'] = float(lon[0]) if len(lon) > 0 else None
-                elif 'longitude' in nc.variables:
-                    profile['longitude'] = float(nc.variables['longitude'][:][0])
-                
-                # Date/Time
-                if 'JULD' in nc.variables:
-                    juld = nc.variables['JULD'][:]
-                    if len(juld) > 0 and not np.ma.is_masked(juld[0]):
-                        # JULD is days since 1950-01-01
-                        ref_date = datetime(1950, 1, 1)
-                        try:
-                            profile_date = ref_date + timedelta(days=float(juld[0]))
-                            profile['date'] = profile_date.date()
-                        except:
-                            profile['date'] = datetime.now().date()
-                    else:
-                        profile['date'] = datetime.now().date()
-                else:
-                    profile['date'] = datetime.now().date()
-                
-                # Platform and institution info
-                if 'PLATFORM_NUMBER' in nc.variables:
-                    platform = nc.variables['PLATFORM_NUMBER'][:]
-                    if hasattr(platform, 'tobytes'):
-                        profile['platform_number'] = platform.tobytes().decode('utf-8').strip()
-                    else:
-                        profile['platform_number'] = str(platform[0]).strip()
-                
-                if 'DATA_CENTRE' in nc.variables:
-                    dc = nc.variables['DATA_CENTRE'][:]
-                    if hasattr(dc, 'tobytes'):
-                        profile['data_centre'] = dc.tobytes().decode('utf-8').strip()
-                    else:
-                        profile['data_centre'] = str(dc[0]).strip()
-                
-                if 'WMO_INST_TYPE' in nc.variables:
-                    wmo = nc.variables['WMO_INST_TYPE'][:]
-                    if hasattr(wmo, 'tobytes'):
-                        profile['wmo_inst_type'] = wmo.tobytes().decode('utf-8').strip()
-                    else:
-                        profile['wmo_inst_type'] = str(wmo[0]).strip()
-                
-                if 'PROJECT_NAME' in nc.variables:
-                    proj = nc.variables['PROJECT_NAME'][:]
-                    if hasattr(proj, 'tobytes'):
-                        profile['project_name'] = proj.tobytes().decode('utf-8').strip()
-                    else:
-                        profile['project_name'] = str(proj[0]).strip()
-                
-                # Ocean data (temperature, salinity, pressure)
-                ocean_data = {}
-                
-                # Pressure/Depth
-                if 'PRES' in nc.variables:
-                    pres = nc.variables['PRES'][:]
-                    if not np.ma.is_masked(pres):
-                        ocean_data['pressure'] = pres.compressed().tolist()
-                
-                # Temperature
-                if 'TEMP' in nc.variables:
-                    temp = nc.variables['TEMP'][:]
-                    if not np.ma.is_masked(temp):
-                        ocean_data['temperature'] = temp.compressed().tolist()
-                
-                # Salinity
-                if 'PSAL' in nc.variables:
-                    psal = nc.variables['PSAL'][:]
-                    if not np.ma.is_masked(psal):
-                        ocean_data['salinity'] = psal.compressed().tolist()
-                
-                profile['ocean_data'] = ocean_data
-                profile['file_path'] = nc_file_path
-                
-                # Basic validation
-                if (profile.get('latitude') is None or 
-                    profile.get('longitude') is None or
-                    abs(profile.get('latitude', 999)) > 90 or
-                    abs(profile.get('longitude', 999)) > 180):
-                    return None
-                
-                return profile
-                
-        except Exception as e:
-            logger.debug(f"Failed to extract from {nc_file_path}: {e}")
-            return None
+        return extract_profile_from_nc(nc_file_path)
+    
+    def _write_parquet_batch(self, profiles: List[Dict[str, Any]]) -> str:
+        """Write the batch's ocean_data arrays as one long-format Parquet table, one row per level"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        columns = {'profile_idx': [], 'depth_idx': []}
+        columns.update({key: [] for _, key in OCEAN_FIELDS})
+        for idx, profile in enumerate(profiles):
+            ocean_data = profile.get('ocean_data', {})
+            levels = max((len(values) for values in ocean_data.values()), default=0)
+            columns['profile_idx'].append(np.full(levels, idx, dtype=np.int32))
+            columns['depth_idx'].append(np.arange(levels, dtype=np.int32))
+            for _, key in OCEAN_FIELDS:
+                values = ocean_data.get(key)
+                if values is None or len(values) != levels:
+                    # Variable missing (or dropped for fill values) in this file
+                    values = np.full(levels, np.nan, dtype=np.float32)
+                columns[key].append(values)
+        
+        table = pa.table({name: np.concatenate(parts) for name, parts in columns.items()})
+        
+        self.parquet_dir.mkdir(parents=True, exist_ok=True)
+        path = self.parquet_dir / f"ocean_batch_{self._parquet_batches:06d}.parquet"
+        self._parquet_batches += 1
+        pq.write_table(table, path, compression='zstd')
+        return str(path)
     
     def batch_insert_profiles(self, profiles: List[Dict[str, Any]]):
         """Insert batch of profiles into database"""
@@ -179,110 +350,119 @@ class ARGONetCDFExtractor:
             return 0
         
         conn = self.get_connection()
-        cursor = conn.cursor()
+        parquet_path = None
         
         try:
-            # Prepare data for insertion
-            insert_data = []
-            for profile in profiles:
-                insert_data.append((
+            if self.parquet_dir is not None:
+                parquet_path = self._write_parquet_batch(profiles)
+            
+            # Build one CSV stream for COPY instead of a parsed multi-row INSERT
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            for idx, profile in enumerate(profiles):
+                data_centre = profile.get('data_centre')
+                ocean_data = {} if parquet_path or self.pack_ocean else profile.get('ocean_data', {})
+                # bytea in hex text form, which COPY's CSV input accepts
+                ocean_blob = '\\x' + pack_ocean_data(profile.get('ocean_data', {})).hex() if self.pack_ocean else None
+                institution = 'Unknown' if data_centre is None else data_centre
+                writer.writerow((
                     profile.get('latitude'),
                     profile.get('longitude'),
                     profile.get('date'),
-                    profile.get('data_centre', 'Unknown')[:100],  # institution
+                    institution[:100],
                     profile.get('platform_number', 'Unknown')[:50],
                     1,  # position_qc
-                    json.dumps(profile.get('ocean_data', {})),
+                    orjson.dumps(ocean_data, option=orjson.OPT_SERIALIZE_NUMPY).decode(),
                     profile.get('file_path'),
                     profile.get('wmo_inst_type', '')[:50],
                     profile.get('project_name', '')[:100],
-                    profile.get('data_centre', '')[:50]
+                    (data_centre or '')[:50],
+                    parquet_path,
+                    idx if parquet_path else None,
+                    ocean_blob
                 ))
+            buf.seek(0)
             
-            # Batch insert
-            insert_query = """
-            INSERT INTO argo_profiles (
-                latitude, longitude, date, institution, platform_number,
-                position_qc, ocean_data, file_path, wmo_inst_type, project_name, data_centre
-            ) VALUES %s
-            """
-            
-            execute_values(cursor, insert_query, insert_data, page_size=1000)
+            with conn.cursor() as cursor:
+                cursor.copy_expert(COPY_PROFILES_SQL, buf)
             conn.commit()
             
-            inserted_count = len(insert_data)
-            conn.close()
-            return inserted_count
+            return len(profiles)
             
         except Exception as e:
             logger.error(f"Batch insert failed: {e}")
-            conn.rollback()
-            conn.close()
+            if parquet_path:
+                # No rows reference the sidecar file
+                Path(parquet_path).unlink(missing_ok=True)
+            try:
+                conn.rollback()
+            except Exception:
+                # Broken connection; get_connection() opens a new one for the next batch
+                conn.close()
             return 0
     
-    def extract_all_profiles(self, max_files: Optional[int] = None, sample_rate: int = 1):
+    def extract_all_profiles(self, max_files: Optional[int] = None, sample_rate: int = 1, max_workers: Optional[int] = None):
         """
         Extract all ARGO profiles from NetCDF files
         
         Args:
             max_files: Maximum number of files to process (None for all)
             sample_rate: Process every Nth file (1 for all files, 10 for every 10th file)
+            max_workers: Extraction processes (None for os.cpu_count())
         """
+        from tqdm import tqdm
+        
         logger.info(f" Starting ARGO NetCDF extraction")
         logger.info(f"Sample rate: 1/{sample_rate} files")
         
-        # Create fresh table
+        # Create fresh table; indexes are built after the load
         self.create_table()
         
-        # Find all NetCDF files
-        nc_pattern = os.path.join("gadr", "data", "indian", "**", "*.nc")
-        all_nc_files = glob.glob(nc_pattern, recursive=True)
-        
-        # Apply sampling
-        nc_files = all_nc_files[::sample_rate]
-        
-        if max_files:
-            nc_files = nc_files[:max_files]
-        
-        total_files = len(nc_files)
-        logger.info(f" Found {len(all_nc_files):,} total NetCDF files")
-        logger.info(f" Processing {total_files:,} files (sample rate: 1/{sample_rate})")
+        # Stream NetCDF paths instead of globbing the whole mirror into a list first
+        nc_root = os.path.join("gadr", "data", "indian")
+        nc_files = iter_nc_files(nc_root, sample_rate, max_files)
+        logger.info(f" Processing NetCDF files under {nc_root} (sample rate: 1/{sample_rate})")
         
-        # Process in batches
-        batch_size = 100
+        # Process in batches; each COPY carries INSERT_BATCH_SIZE rows (a few KB each)
+        batch_size = INSERT_BATCH_SIZE
         profiles_batch = []
         
         start_time = time.time()
         
-        with tqdm(total=total_files, desc="Extracting profiles") as pbar:
-            for i, nc_file in enumerate(nc_files):
-                # Extract profile
-                profile = self.extract_profile_from_nc(nc_file)
-                
-                if profile:
-                    profiles_batch.append(profile)
-                    self.stats['processed'] += 1
-                else:
-                    self.stats['skipped'] += 1
-                
-                # Insert batch when full
-                if len(profiles_batch) >= batch_size:
-                    inserted = self.batch_insert_profiles(profiles_batch)
-                    self.stats['inserted'] += inserted
-                    profiles_batch = []
+        # Files are parsed in worker processes; stats and DB inserts stay in this process
+        try:
+            with tqdm(total=max_files, desc="Extracting profiles") as pbar, \
+                    ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                        initializer=_init_extract_worker) as executor:
+                profiles = executor.map(extract_profile_from_nc, nc_files, chunksize=EXTRACT_CHUNKSIZE)
+                for i, profile in enumerate(profiles):
+                    if profile:
+                        profiles_batch.append(profile)
+                        self.stats['processed'] += 1
+                    else:
+                        self.stats['skipped'] += 1
                     
-                    # Progress update
-                    if (i + 1) % 1000 == 0:
+                    # Insert batch when full
+                    if len(profiles_batch) >= batch_size:
+                        inserted = self.batch_insert_profiles(profiles_batch)
+                        self.stats['inserted'] += inserted
+                        profiles_batch = []
+                        
+                        # Progress update, once per stored batch
                         elapsed = time.time() - start_time
                         rate = (i + 1) / elapsed if elapsed > 0 else 0
-                        logger.info(f"Progress: {i+1:,}/{total_files:,} files, {self.stats['inserted']:,} profiles inserted ({rate:.1f} files/sec)")
-                
-                pbar.update(1)
-        
-        # Insert remaining profiles
-        if profiles_batch:
-            inserted = self.batch_insert_profiles(profiles_batch)
-            self.stats['inserted'] += inserted
+                        logger.info(f"Progress: {i+1:,} files, {self.stats['inserted']:,} profiles inserted ({rate:.1f} files/sec)")
+                    
+                    pbar.update(1)
+        finally:
+            # An interrupted run still stores what was parsed and leaves the table indexed
+            try:
+                if profiles_batch:
+                    inserted = self.batch_insert_profiles(profiles_batch)
+                    self.stats['inserted'] += inserted
+                self.create_indexes()
+            finally:
+                self.close()
         
         elapsed_time = time.time() - start_time
         
@@ -297,8 +477,6 @@ class ARGONetCDFExtractor:
         return self.stats['inserted']
 
 def main():
-    from datetime import timedelta
-    
     extractor = ARGONetCDFExtractor()
     
     # Extract with sampling for reasonable processing time
@@ -5,24 +5,100 @@ Extracts essential data from NetCDF files for the RAG system
 """
 import os
 import sys
-import glob
+import weakref
 import netCDF4 as nc
+import numpy as np
 import psycopg2
-import json
-from datetime import datetime
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+import orjson
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from tqdm import tqdm
 
 # Add config to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from config.database import get_database_url
+from helpers.data_extraction.argo_netcdf_extractor import decode_char_array, iter_nc_files
+
+DB_POOL_MIN_CONNECTIONS = 2
+DB_POOL_MAX_CONNECTIONS = 16
+
+# NetCDF character variables copied onto the profile dict
+CHAR_FIELDS = (('INSTITUTION', 'institution'), ('PLATFORM_NUMBER', 'platform_number'), ('POSITION_QC', 'position_qc'))
+
+# NetCDF variables kept in ocean_data, first OCEAN_POINTS_LIMIT valid points each
+OCEAN_FIELDS = (('TEMP', 'temperature'), ('PSAL', 'salinity'), ('PRES', 'pressure'))
+OCEAN_POINTS_LIMIT = 50
+
+# Rows per INSERT/commit in process_directory
+INSERT_BATCH_SIZE = 1000
+
+# NOT NULL in every argo_profiles schema; profiles missing one are never batched
+REQUIRED_FIELDS = ('latitude', 'longitude', 'date')
+
+INSERT_PROFILES_QUERY = """
+INSERT INTO argo_profiles 
+(latitude, longitude, date, institution, platform_number, position_qc, ocean_data, file_path)
+VALUES %s
+"""
+
+# Single-row insert used when a batch fails and process_directory retries it row by row;
+# prepared once per pooled connection so each of those rows skips parse/plan.
+# Parameter types are inferred from the argo_profiles columns
+PREPARE_INSERT_PROFILE_SQL = """
+PREPARE insert_profile AS
+INSERT INTO argo_profiles 
+(latitude, longitude, date, institution, platform_number, position_qc, ocean_data, file_path)
+VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+RETURNING profile_id
+"""
+EXECUTE_INSERT_PROFILE_SQL = "EXECUTE insert_profile (%s, %s, %s, %s, %s, %s, %s, %s)"
+
+def _profile_row(profile_data):
+    return (
+        profile_data.get('latitude'),
+        profile_data.get('longitude'), 
+        profile_data.get('date'),
+        profile_data.get('institution'),
+        profile_data.get('platform_number'),
+        profile_data.get('position_qc'),
+        orjson.dumps(profile_data.get('ocean_data', {}), option=orjson.OPT_SERIALIZE_NUMPY).decode(),
+        profile_data.get('file_path')
+    )
 
 class SimpleArgoExtractor:
     def __init__(self):
         self.db_url = get_database_url()
-        
+        self._pool = None
+        self._prepared = weakref.WeakSet()  # Pooled connections that already ran PREPARE
+    
+    @contextmanager
     def get_db_connection(self):
-        """Get database connection"""
-        return psycopg2.connect(self.db_url)
+        """Lease a pooled database connection for the duration of a with-block"""
+        if self._pool is None:
+            self._pool = ThreadedConnectionPool(DB_POOL_MIN_CONNECTIONS, DB_POOL_MAX_CONNECTIONS, dsn=self.db_url)
+        conn = self._pool.getconn()
+        try:
+            yield conn
+        finally:
+            # putconn rolls back anything left open and discards closed connections
+            self._pool.putconn(conn)
+    
+    def close(self):
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+        self._prepared = weakref.WeakSet()
+    
+    def _prepare_insert(self, conn):
+        """PREPARE the single-row insert on conn the first time it is leased"""
+        if conn in self._prepared:
+            return
+        with conn.cursor() as cursor:
+            cursor.execute(PREPARE_INSERT_PROFILE_SQL)
+        conn.commit()
+        self._prepared.add(conn)
     
     def extract_netcdf_data(self, file_path):
         """Extract essential data from a NetCDF file"""
@@ -30,16 +106,19 @@ class SimpleArgoExtractor:
             with nc.Dataset(file_path, 'r') as dataset:
                 # Extract basic profile information
                 data = {}
+                # Look the variable dict up once; every read below goes through it
+                v = dataset.variables
                 
                 # Geographic coordinates
-                if 'LATITUDE' in dataset.variables:
-                    data['latitude'] = float(dataset.variables['LATITUDE'][0]) if len(dataset.variables['LATITUDE']) > 0 else None
-                if 'LONGITUDE' in dataset.variables:
-                    data['longitude'] = float(dataset.variables['LONGITUDE'][0]) if len(dataset.variables['LONGITUDE']) > 0 else None
+                for var_name, key in (('LATITUDE', 'latitude'), ('LONGITUDE', 'longitude')):
+                    var = v.get(var_name)
+                    if var is not None:
+                        data[key] = float(var[0]) if len(var) > 0 else None
                 
                 # Date information
-                if 'JULD' in dataset.variables:
-                    juld = dataset.variables['JULD'][0] if len(dataset.variables['JULD']) > 0 else None
+                juld_var = v.get('JULD')
+                if juld_var is not None:
+                    juld = juld_var[0] if len(juld_var) > 0 else None
                     if juld and juld != nc.default_fillvals['f8']:
                         # Convert Julian day to datetime (ARGO reference: 1950-01-01)
                         try:
@@ -51,59 +130,31 @@ class SimpleArgoExtractor:
                     else:
                         data['date'] = None
                 
-                # Institution
-                if 'INSTITUTION' in dataset.variables:
-                    try:
-                        inst = dataset.variables['INSTITUTION'][:].tobytes().decode('utf-8').strip()
-                        data['institution'] = inst if inst else None
-                    except:
-                        data['institution'] = None
-                
-                # Platform number
-                if 'PLATFORM_NUMBER' in dataset.variables:
-                    try:
-                        platform = dataset.variables['PLATFORM_NUMBER'][:].tobytes().decode('utf-8').strip()
-                        data['platform_number'] = platform if platform else None
-                    except:
-                        data['platform_number'] = None
+                # Institution, platform number and position QC
+                for var_name, key in CHAR_FIELDS:
+                    var = v.get(var_name)
+                    if var is not None:
+                        try:
+                            text = decode_char_array(var[:])
+                            data[key] = text if text else None
+                        except:
+                            data[key] = None
                 
-                # Position QC
-                if 'POSITION_QC' in dataset.variables:
-                    try:
-                        qc = dataset.variables['POSITION_QC'][:].tobytes().decode('utf-8').strip()
-                        data['position_qc'] = qc if qc else None
-                    except:
-                        data['position_qc'] = None
+                # position_qc is an INTEGER column; ARGO stores the flag as a char
+                qc = data.get('position_qc')
+                if qc is not None:
+                    data['position_qc'] = int(qc) if qc.isdigit() else None
                 
                 # Ocean data (simplified)
                 ocean_data = {}
                 
-                # Temperature
-                if 'TEMP' in dataset.variables:
-                    temp = dataset.variables['TEMP'][:]
-                    if hasattr(temp, 'mask'):
-                        temp_values = temp.compressed().tolist()[:50]  # Limit to first 50 points
-                    else:
-                        temp_values = temp.flatten().tolist()[:50]
-                    ocean_data['temperature'] = temp_values
-                
-                # Salinity
-                if 'PSAL' in dataset.variables:
-                    psal = dataset.variables['PSAL'][:]
-                    if hasattr(psal, 'mask'):
-                        psal_values = psal.compressed().tolist()[:50]
-                    else:
-                        psal_values = psal.flatten().tolist()[:50]
-                    ocean_data['salinity'] = psal_values
-                
-                # Pressure
-                if 'PRES' in dataset.variables:
-                    pres = dataset.variables['PRES'][:]
-                    if hasattr(pres, 'mask'):
-                        pres_values = pres.compressed().tolist()[:50]
-                    else:
-                        pres_values = pres.flatten().tolist()[:50]
-                    ocean_data['pressure'] = pres_values
+                for var_name, key in OCEAN_FIELDS:
+                    var = v.get(var_name)
+                    if var is not None:
+                        values = var[:]
+                        values = values.compressed() if hasattr(values, 'mask') else values.ravel()
+                        # Slice before converting so only the kept points are copied; orjson encodes the array
+                        ocean_data[key] = np.asarray(values[:OCEAN_POINTS_LIMIT], dtype=np.float32)
                 
                 data['ocean_data'] = ocean_data
                 data['file_path'] = file_path
@@ -115,73 +166,84 @@ class SimpleArgoExtractor:
             return None
     
     def insert_profile(self, profile_data):
-        """Insert a single profile into the database"""
+        """Insert a single profile into the database (process_directory's per-row retry path)"""
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            
-            insert_query = """
-            INSERT INTO argo_profiles 
-            (latitude, longitude, date, institution, platform_number, position_qc, ocean_data, file_path)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING profile_id
-            """
-            
-            cursor.execute(insert_query, (
-                profile_data.get('latitude'),
-                profile_data.get('longitude'), 
-                profile_data.get('date'),
-                profile_data.get('institution'),
-                profile_data.get('platform_number'),
-                profile_data.get('position_qc'),
-                json.dumps(profile_data.get('ocean_data', {})),
-                profile_data.get('file_path')
-            ))
-            
-            profile_id = cursor.fetchone()[0]
-            conn.commit()
-            conn.close()
-            return profile_id
+            with self.get_db_connection() as conn:
+                self._prepare_insert(conn)
+                with conn.cursor() as cursor:
+                    cursor.execute(EXECUTE_INSERT_PROFILE_SQL, _profile_row(profile_data))
+                    profile_id = cursor.fetchone()[0]
+                conn.commit()
+                return profile_id
             
         except Exception as e:
             print(f"Database insert error: {e}")
-            if conn:
-                conn.close()
             return None
     
+    def insert_profile_bulk(self, cursor, batch):
+        """Insert a batch of profiles on an open cursor; the caller commits"""
+        execute_values(cursor, INSERT_PROFILES_QUERY, [_profile_row(p) for p in batch],
+                       page_size=INSERT_BATCH_SIZE)
+        return len(batch)
+    
     def process_directory(self, data_dir, max_files=1000):
         """Process NetCDF files in a directory"""
-        # Find all NetCDF files
-        pattern = os.path.join(data_dir, "**", "*.nc")
-        nc_files = glob.glob(pattern, recursive=True)
-        
-        if max_files:
-            nc_files = nc_files[:max_files]
+        # Stream NetCDF files instead of listing the whole tree first; a missing or
+        # unreadable directory yields nothing rather than raising
+        nc_files = iter_nc_files(data_dir, max_files=max_files)
         
-        print(f"Found {len(nc_files)} NetCDF files to process")
+        print(f"Processing {'up to ' + str(max_files) if max_files else 'all'} NetCDF files in {data_dir}")
         
         successful = 0
         failed = 0
+        batch = []
         
-        for file_path in tqdm(nc_files, desc="Processing files"):
-            profile_data = self.extract_netcdf_data(file_path)
+        def flush():
+            nonlocal successful, failed
+            # Lease per batch: a connection broken mid-run is discarded by the pool, not reused
+            with self.get_db_connection() as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        inserted = self.insert_profile_bulk(cursor, batch)
+                    conn.commit()
+                    successful += inserted
+                    batch.clear()
+                    return
+                except Exception as e:
+                    print(f"Batch insert error, retrying row by row: {e}")
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        # Broken connection; putconn drops it and the retry leases a new one
+                        conn.close()
             
-            if profile_data:
-                profile_id = self.insert_profile(profile_data)
-                if profile_id:
+            # One bad row only costs that row, as with per-row inserts
+            for profile_data in batch:
+                if self.insert_profile(profile_data) is not None:
                     successful += 1
                 else:
                     failed += 1
+            batch.clear()
+        
+        for file_path in tqdm(nc_files, total=max_files or None, desc="Processing files"):
+            profile_data = self.extract_netcdf_data(file_path)
+            
+            if profile_data and all(profile_data.get(field) is not None for field in REQUIRED_FIELDS):
+                batch.append(profile_data)
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    flush()
             else:
                 failed += 1
         
+        if batch:
+            flush()
+        
+        self.close()
         print(f"Processing complete: {successful} successful, {failed} failed")
         return successful
 
 def main():
     """Run the simple extractor"""
-    from datetime import timedelta
-    
     extractor = SimpleArgoExtractor()
     
     # Process a subset of data for testing
@@ -4,44 +4,97 @@ ULTRA-FAST ARGO FULL DATASET EXTRACTOR
 Processes all 214,400+ NetCDF files efficiently with multiprocessing
 """
 import os
-import glob
+import sys
+import csv
+import io
+import itertools
 import logging
-import json
+import queue
+import re
+import threading
 import time
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from collections import deque
+from datetime import date
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
 from netCDF4 import Dataset
+import orjson
 import psycopg2
-from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from dotenv import load_dotenv
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
 import multiprocessing as mp
 
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from helpers.data_extraction.argo_netcdf_extractor import decode_char_array, iter_nc_files
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+# Inserts run on writer threads in the main process; a small pool keeps their TLS sessions alive
+DB_POOL_MIN_CONNECTIONS = 1
+DB_POOL_MAX_CONNECTIONS = 4
+
+# Writer threads draining full batches, and how many batches may wait for them
+WRITER_THREADS = 2
+WRITE_QUEUE_BATCHES = 4
+
+# Directory tasks submitted but not yet consumed, per worker; with the write queue bound
+# this caps how many extracted profiles can sit in memory while the writers catch up
+TASKS_IN_FLIGHT_PER_WORKER = 2
+
+# HDF5 chunk cache per open NetCDF file in the extraction workers
+NC_CHUNK_CACHE_BYTES = 64 * 1024
+
+# Session settings for bulk-load connections: commits skip the WAL flush wait, index builds
+# get enough memory to sort in RAM, and JIT is off since it only adds compile time to inserts
+BULK_LOAD_SESSION_OPTIONS = '-c synchronous_commit=off -c work_mem=256MB -c maintenance_work_mem=1GB -c jit=off'
+
+# Profiles live under .../<year>/<month>/<file>.nc; either path separator is accepted
+_DATE_RE = re.compile(r'[/\\](\d{4})[/\\](\d{2})[/\\][^/\\]+\.nc$')
+DEFAULT_PROFILE_DATE = date(2000, 1, 1)
+
+COPY_PROFILES_SQL = """
+COPY argo_profiles (
+    latitude, longitude, date, institution, platform_number,
+    position_qc, ocean_data, file_path
+) FROM STDIN WITH (FORMAT csv)
+"""
+
+def iter_nc_dir_batches(root):
+    """Yield the .nc files under root as one list per directory. The shared walker scans a
+    directory completely before the next one, so each directory's files arrive together;
+    missing or unreadable directories are skipped there."""
+    for _, nc_files in itertools.groupby(iter_nc_files(root), key=os.path.dirname):
+        yield list(nc_files)
+
+def _init_extract_worker():
+    """Shrink the HDF5 chunk cache: each file is opened once for a handful of small variables,
+    so the default per-open cache is never reused"""
+    import netCDF4
+    netCDF4.set_chunk_cache(size=NC_CHUNK_CACHE_BYTES, nelems=1, preemption=0.0)
+
+def _first_value(variables, *names) -> Optional[float]:
+    """First element of the first of names present in variables, or None"""
+    for name in names:
+        var = variables.get(name)
+        if var is not None:
+            # Read one element, not the whole variable: rejected files never decode the rest
+            return float(var[0:1].flat[0]) if var.size > 0 else None
+    return None
+
 def extract_single_profile(nc_file_path: str) -> Optional[Dict[str, Any]]:
     """Extract single profile - optimized for multiprocessing"""
     try:
         with Dataset(nc_file_path, 'r') as nc:
-            # Quick coordinate extraction
-            lat = lon = None
+            # Look the variable dict up once; every read below goes through it
+            variables = nc.variables
             
-            if 'LATITUDE' in nc.variables:
-                lat_data = nc.variables['LATITUDE'][:]
-                lat = float(lat_data.flat[0]) if len(lat_data) > 0 else None
-            elif 'latitude' in nc.variables:
-                lat_data = nc.variables['latitude'][:]
-                lat = float(lat_data.flat[0]) if len(lat_data) > 0 else None
-                
-            if 'LONGITUDE' in nc.variables:
-                lon_data = nc.variables['LONGITUDE'][:]
-                lon = float(lon_data.flat[0]) if len(lon_data) > 0 else None
-            elif 'longitude' in nc.variables:
-                lon_data = nc.variables['longitude'][:]
-                lon = float(lon_data.flat[0]) if len(lon_data) > 0 else None
+            # Quick coordinate extraction
+            lat = _first_value(variables, 'LATITUDE', 'latitude')
+            lon = _first_value(variables, 'LONGITUDE', 'longitude')
             
             # Validate coordinates
             if (lat is None or lon is None or 
@@ -50,21 +103,20 @@ def extract_single_profile(nc_file_path: str) -> Optional[Dict[str, Any]]:
                 return None
             
             # Extract date from file path (faster than parsing JULD)
-            try:
-                path_parts = nc_file_path.replace('\\', '/').split('/')
-                year = int(path_parts[-3])
-                month = int(path_parts[-2])
-                profile_date = datetime(year, month, 15).date()
-            except:
-                profile_date = datetime(2000, 1, 1).date()
+            m = _DATE_RE.search(nc_file_path)
+            if m and 1 <= int(m[2]) <= 12:
+                profile_date = date(int(m[1]), int(m[2]), 15)
+            else:
+                profile_date = DEFAULT_PROFILE_DATE
             
             # Get platform info (safely)
             platform = 'UNKNOWN'
             try:
-                if 'PLATFORM_NUMBER' in nc.variables:
-                    plat_data = nc.variables['PLATFORM_NUMBER'][:]
-                    if hasattr(plat_data, 'tobytes'):
-                        platform = plat_data.tobytes().decode('utf-8', errors='ignore').strip().replace('\x00', '')
+                plat_var = variables.get('PLATFORM_NUMBER')
+                if plat_var is not None:
+                    plat_data = plat_var[:]
+                    if getattr(plat_data, 'dtype', None) == 'S1':
+                        platform = decode_char_array(plat_data)
                     else:
                         platform = str(plat_data[0])
                 platform = platform[:50] if platform else 'UNKNOWN'
@@ -74,9 +126,11 @@ def extract_single_profile(nc_file_path: str) -> Optional[Dict[str, Any]]:
             # Extract ocean data (temperature, salinity, pressure)
             ocean_data = {}
             try:
-                for var_name in ['PRES', 'TEMP', 'PSAL']:
-                    if var_name in nc.variables:
-                        data = nc.variables[var_name][:]
+                for var_name in ('PRES', 'TEMP', 'PSAL'):
+                    var = variables.get(var_name)
+                    if var is not None:
+                        # First profile only; the other profiles are never decoded (or mixed into the [:100])
+                        data = var[0] if var.ndim > 1 else var[:]
                         if hasattr(data, 'compressed'):
                             clean_data = data.compressed()
                         else:
@@ -85,7 +139,7 @@ def extract_single_profile(nc_file_path: str) -> Optional[Dict[str, Any]]:
                         # Keep only valid data
                         valid_data = clean_data[~np.isnan(clean_data)]
                         if len(valid_data) > 0:
-                            ocean_data[var_name.lower()] = valid_data.tolist()[:100]  # Limit size
+                            ocean_data[var_name.lower()] = valid_data[:100].astype(np.float32)  # Limit size; orjson encodes it
             except:
                 pass
             
@@ -102,6 +156,23 @@ def extract_single_profile(nc_file_path: str) -> Optional[Dict[str, Any]]:
     except Exception as e:
         return None
 
+def _bounded_map(executor, fn, tasks, window: int):
+    """executor.map in order, but with at most window tasks submitted and not yet consumed.
+    executor.map submits every task up front, so finished results pile up if the caller stalls."""
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(fn, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def extract_directory(nc_files: List[str]) -> Tuple[int, List[Dict[str, Any]]]:
+    """Extract one directory's .nc files in one worker call.
+    Returns the number of files seen and the profiles that passed validation."""
+    profiles = [profile for profile in map(extract_single_profile, nc_files) if profile]
+    return len(nc_files), profiles
+
 class UltraFastARGOExtractor:
     def __init__(self):
         self.db_config = {
@@ -112,97 +183,134 @@ class UltraFastARGOExtractor:
             'password': os.getenv('DB_PASSWORD'),
             'sslmode': os.getenv('DB_SSL_MODE', 'require')
         }
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._inserted = 0
+        self._inserted_lock = threading.Lock()
     
+    @contextmanager
     def get_connection(self):
-        return psycopg2.connect(**self.db_config)
+        """Lease a pooled connection for the duration of a with-block"""
+        with self._pool_lock:
+            if self._pool is None:
+                # Every pooled connection (setup, writers, finish_bulk_load) gets the bulk-load session
+                self._pool = ThreadedConnectionPool(DB_POOL_MIN_CONNECTIONS, DB_POOL_MAX_CONNECTIONS,
+                                                    options=BULK_LOAD_SESSION_OPTIONS, **self.db_config)
+        conn = self._pool.getconn()
+        try:
+            yield conn
+        finally:
+            # putconn rolls back anything left open and discards closed connections
+            self._pool.putconn(conn)
+    
+    def close(self):
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
     
     def setup_database(self):
         """Setup optimized database for bulk insert"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Drop and recreate for clean start
-        cursor.execute("DROP TABLE IF EXISTS argo_profiles CASCADE;")
-        cursor.execute("DROP TABLE IF EXISTS profile_embeddings CASCADE;")
-        
-        # Create optimized table
-        cursor.execute("""
-        CREATE TABLE argo_profiles (
-            profile_id SERIAL PRIMARY KEY,
-            latitude FLOAT NOT NULL,
-            longitude FLOAT NOT NULL,
-            date DATE NOT NULL,
-            institution VARCHAR(20) DEFAULT 'ARGO',
-            platform_number VARCHAR(50),
-            position_qc INTEGER DEFAULT 1,
-            ocean_data JSONB,
-            file_path TEXT,
-            created_at TIMESTAMP DEFAULT NOW()
-        );
-        """)
-        
-        # Create embedding table with correct schema
-        cursor.execute("""
-        CREATE TABLE profile_embeddings (
-            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-            profile_id VARCHAR NOT NULL,
-            content_type VARCHAR NOT NULL,
-            content_text TEXT,
-            embedding VECTOR(384),
-            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-        );
-        """)
-        
-        conn.commit()
-        conn.close()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Drop and recreate for clean start
+            cursor.execute("DROP TABLE IF EXISTS argo_profiles CASCADE;")
+            cursor.execute("DROP TABLE IF EXISTS profile_embeddings CASCADE;")
+            
+            # Create optimized table: UNLOGGED and unindexed while the bulk load runs,
+            # finish_bulk_load() makes it durable and indexes it afterwards
+            cursor.execute("""
+            CREATE UNLOGGED TABLE argo_profiles (
+                profile_id SERIAL PRIMARY KEY,
+                latitude FLOAT NOT NULL,
+                longitude FLOAT NOT NULL,
+                date DATE NOT NULL,
+                institution VARCHAR(20) DEFAULT 'ARGO',
+                platform_number VARCHAR(50),
+                position_qc INTEGER DEFAULT 1,
+                ocean_data JSONB,
+                file_path TEXT,
+                created_at TIMESTAMP DEFAULT NOW()
+            );
+            """)
+            
+            # Create embedding table with correct schema
+            cursor.execute("""
+            CREATE TABLE profile_embeddings (
+                id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+                profile_id VARCHAR NOT NULL,
+                content_type VARCHAR NOT NULL,
+                content_text TEXT,
+                embedding VECTOR(384),
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+            );
+            """)
+            cursor.execute("CREATE INDEX idx_profile_embeddings_profile_id ON profile_embeddings (profile_id);")
+            
+            conn.commit()
         logger.info(" Database setup complete")
     
+    def finish_bulk_load(self):
+        """Make argo_profiles crash-safe and build its indexes once all rows are in"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Plain CREATE INDEX: nothing else reads the table yet, so CONCURRENTLY would only be slower
+            cursor.execute("""
+            ALTER TABLE argo_profiles SET LOGGED;
+            CREATE INDEX IF NOT EXISTS idx_argo_lat_lon ON argo_profiles(latitude, longitude);
+            CREATE INDEX IF NOT EXISTS idx_argo_date ON argo_profiles(date);
+            CREATE INDEX IF NOT EXISTS idx_argo_institution ON argo_profiles(institution);
+            ANALYZE argo_profiles;
+            """)
+            conn.commit()
+        logger.info(" argo_profiles logged and indexed")
+    
     def bulk_insert_profiles(self, profiles: List[Dict[str, Any]]) -> int:
         """Ultra-fast bulk insert"""
         if not profiles:
             return 0
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            # Prepare data
-            insert_data = []
-            for profile in profiles:
-                insert_data.append((
-                    profile['latitude'],
-                    profile['longitude'],
-                    profile['date'],
-                    profile['institution'],
-                    profile['platform_number'],
-                    1,
-                    json.dumps(profile['ocean_data']),
-                    profile['file_path']
-                ))
-            
-            # Ultra-fast bulk insert
-            query = """
-            INSERT INTO argo_profiles (
-                latitude, longitude, date, institution, platform_number,
-                position_qc, ocean_data, file_path
-            ) VALUES %s
-            """
-            
-            execute_values(
-                cursor, query, insert_data, 
-                template=None, page_size=10000
-            )
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
             
-            conn.commit()
-            inserted = len(insert_data)
-            conn.close()
-            return inserted
-            
-        except Exception as e:
-            logger.error(f"Bulk insert failed: {e}")
-            conn.rollback()
-            conn.close()
-            return 0
+            try:
+                # One CSV stream for COPY instead of parsed INSERT statements
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                for profile in profiles:
+                    writer.writerow((
+                        profile['latitude'],
+                        profile['longitude'],
+                        profile['date'],
+                        profile['institution'],
+                        profile['platform_number'],
+                        1,
+                        orjson.dumps(profile['ocean_data'], option=orjson.OPT_SERIALIZE_NUMPY).decode(),
+                        profile['file_path']
+                    ))
+                buf.seek(0)
+                
+                cursor.copy_expert(COPY_PROFILES_SQL, buf)
+                
+                conn.commit()
+                return len(profiles)
+                
+            except Exception as e:
+                logger.error(f"Bulk insert failed: {e}")
+                conn.rollback()
+                return 0
+    
+    def _insert_worker(self, batches: queue.Queue):
+        """Writer thread: COPY queued batches until the None sentinel arrives"""
+        while (batch := batches.get()) is not None:
+            try:
+                count = self.bulk_insert_profiles(batch)
+            except Exception as e:
+                # Keep draining; a dead writer would leave the producer blocked on a full queue
+                logger.error(f"Bulk insert failed: {e}")
+                count = 0
+            with self._inserted_lock:
+                self._inserted += count
     
     def extract_all_profiles_parallel(self, max_workers: int = None):
         """Extract ALL profiles using parallel processing"""
@@ -211,17 +319,10 @@ class UltraFastARGOExtractor:
         # Setup database
         self.setup_database()
         
-        # Find all NetCDF files
-        logger.info(" Finding all NetCDF files...")
-        nc_pattern = os.path.join("gadr", "data", "indian", "**", "*.nc")
-        all_nc_files = glob.glob(nc_pattern, recursive=True)
-        
-        total_files = len(all_nc_files)
-        logger.info(f" Found {total_files:,} NetCDF files")
-        
-        if total_files == 0:
-            logger.error(" No NetCDF files found!")
-            return 0
+        # Stream one task per directory to the workers while the walk is still running
+        nc_root = os.path.join("gadr", "data", "indian")
+        logger.info(f" Streaming NetCDF directories from {nc_root}")
+        nc_dirs = iter_nc_dir_batches(nc_root)
         
         # Setup multiprocessing
         if max_workers is None:
@@ -229,50 +330,64 @@ class UltraFastARGOExtractor:
         
         logger.info(f" Using {max_workers} parallel workers")
         
-        # Process files in parallel
+        # Process files in parallel; full batches are handed to writer threads so decoding
+        # keeps going while a COPY waits on the network
         processed = 0
-        inserted = 0
         batch_size = 5000  # Large batches for efficiency
         profiles_batch = []
+        self._inserted = 0
+        
+        batches = queue.Queue(maxsize=WRITE_QUEUE_BATCHES)
+        writers = [threading.Thread(target=self._insert_worker, args=(batches,), daemon=True)
+                   for _ in range(WRITER_THREADS)]
+        for writer in writers:
+            writer.start()
         
         start_time = time.time()
         
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all files for processing
-            future_to_file = {
-                executor.submit(extract_single_profile, nc_file): nc_file 
-                for nc_file in all_nc_files
-            }
-            
-            # Collect results as they complete
-            for future in as_completed(future_to_file):
-                processed += 1
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_extract_worker) as executor:
+                # One directory per task; extract_single_profile returns None instead of raising.
+                # While the main thread blocks on a full write queue no new tasks are submitted
+                results = _bounded_map(executor, extract_directory, nc_dirs,
+                                       max_workers * TASKS_IN_FLIGHT_PER_WORKER)
                 
-                try:
-                    profile = future.result()
-                    if profile:
-                        profiles_batch.append(profile)
+                for file_count, dir_profiles in results:
+                    processed += file_count
+                    profiles_batch.extend(dir_profiles)
+                    
+                    # Queue the batch when full; blocks only if the writers fall behind
+                    if len(profiles_batch) >= batch_size:
+                        batches.put(profiles_batch)
+                        profiles_batch = []
                         
-                        # Insert when batch is full
-                        if len(profiles_batch) >= batch_size:
-                            batch_inserted = self.bulk_insert_profiles(profiles_batch)
-                            inserted += batch_inserted
-                            profiles_batch = []
-                            
-                            # Progress update
-                            elapsed = time.time() - start_time
-                            rate = processed / elapsed if elapsed > 0 else 0
-                            progress = (processed / total_files) * 100
-                            
-                            logger.info(f" Progress: {processed:,}/{total_files:,} ({progress:.1f}%) | "
-                                      f"Inserted: {inserted:,} | Rate: {rate:.1f} files/sec")
-                except Exception as e:
-                    logger.debug(f"Failed to process file: {e}")
+                        # Progress update
+                        elapsed = time.time() - start_time
+                        rate = processed / elapsed if elapsed > 0 else 0
+                        logger.info(f" Progress: {processed:,} files | "
+                                  f"Inserted: {self._inserted:,} | Rate: {rate:.1f} files/sec")
+            
+            # Insert remaining profiles
+            if profiles_batch:
+                batches.put(profiles_batch)
+        finally:
+            for _ in writers:
+                batches.put(None)
+            for writer in writers:
+                writer.join()
+            
+            # Also on failure: Postgres empties an UNLOGGED table after a server crash
+            try:
+                self.finish_bulk_load()
+            except Exception as e:
+                logger.error(f" finish_bulk_load failed, argo_profiles is still UNLOGGED and unindexed: {e}")
+                raise
+            finally:
+                self.close()
         
-        # Insert remaining profiles
-        if profiles_batch:
-            batch_inserted = self.bulk_insert_profiles(profiles_batch)
-            inserted += batch_inserted
+        inserted = self._inserted
+        if processed == 0:
+            logger.error(" No NetCDF files found!")
         
         # Final statistics
         elapsed_time = time.time() - start_time
@@ -97,10 +97,12 @@ def check_profiles_table():
                 
                 # Get column info
                 result = conn.execute(text("""
-                    SELECT column_name, data_type, is_nullable
-                    FROM information_schema.columns 
-                    WHERE table_name = 'profiles'
-                    ORDER BY ordinal_position;
+                    SELECT a.attname, format_type(a.atttypid, a.atttypmod),
+                           CASE WHEN a.attnotnull THEN 'NO' ELSE 'YES' END
+                    FROM pg_attribute a
+                    WHERE a.attrelid = to_regclass('profiles')
+                      AND a.attnum > 0 AND NOT a.attisdropped
+                    ORDER BY a.attnum;
                 """))
                 
                 columns = result.fetchall()
@@ -4,7 +4,7 @@ Simple Mock Data Generator for ARGO Profiles
 Creates sample oceanographic data for testing the RAG system
 """
 import psycopg2
-import json
+import orjson
 import random
 from datetime import datetime, date, timedelta
 from tqdm import tqdm
@@ -109,7 +109,7 @@ class MockArgoGenerator:
                 profile_data['institution'],
                 profile_data['platform_number'],
                 profile_data['position_qc'],
-                json.dumps(profile_data['ocean_data']),
+                orjson.dumps(profile_data['ocean_data']).decode(),
                 profile_data['file_path']
             ))
             